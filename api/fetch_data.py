@@ -1,11 +1,19 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import configparser
-from sqlalchemy import Integer, String, Float, DateTime, Boolean
-from datetime import datetime 
+import math
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import logging
 
-from utils.utils import is_datetime
+from api.json_stream import iter_records
+from api.response_cache import ResponseCache
+from utils.single_flight import SingleFlight
+from utils.type_inference import infer_field_kinds
 
 # Configure logging
 logging.basicConfig(filename='logs.log', level=logging.INFO,
@@ -15,93 +23,607 @@ logging.basicConfig(filename='logs.log', level=logging.INFO,
 config = configparser.ConfigParser()
 config.read('config.ini')
 API_URL = config['api']['eso_auction_results_url']
-RESOURCE_ID = config['api']['resource_id']
-LIMIT = config['api'].getint('limit')  # default to 100 if not specified in config.ini
+# Default resource of the fetch functions; each [resource:*] section names its own
+RESOURCE_ID = config['api'].get('resource_id', fallback=None)
+LIMIT = config['api'].getint('limit', fallback=100)
+# Page size for the keyset-paginated fetch; 0 keeps the single-request mode
+PAGE_SIZE = config['api'].getint('page_size', fallback=0)
+SQL_API_URL = config['api'].get('eso_auction_results_sql_url', fallback=f"{API_URL}_sql")
+RESOURCE_SHOW_URL = config['api'].get('eso_resource_show_url',
+                                      fallback=f"{API_URL.rsplit('/', 1)[0]}/resource_show")
+# Decode result.records incrementally instead of building the whole response in memory
+STREAM_RESPONSES = config['api'].getboolean('stream_responses', fallback=False)
+STREAM_CHUNK_SIZE = 64 * 1024
+# Always fetched and stored, whatever field list a resource projects
+MANDATORY_FIELDS = ('_id', 'deliveryStart', 'deliveryEnd')
+# SQLAlchemy type (by name) of each CKAN datastore column type; datastore_search
+# reports the generic names, datastore_search_sql the PostgreSQL ones
+CKAN_TYPES = {
+    'int': 'Integer', 'int2': 'Integer', 'int4': 'Integer', 'int8': 'Integer', 'bigint': 'Integer',
+    'numeric': 'Float', 'float4': 'Float', 'float8': 'Float',
+    'timestamp': 'DateTime', 'timestamptz': 'DateTime', 'date': 'DateTime',
+    'bool': 'Boolean',
+    'text': 'String', 'varchar': 'String',
+}
+# SQLAlchemy type (by name) of each inferred value kind; always-null fields are strings
+KIND_TYPES = {'bool': 'Boolean', 'int': 'Integer', 'float': 'Float', 'datetime': 'DateTime', 'string': 'String',
+              None: 'String'}
+# Records inspected when inferring untyped fields, and the run of unchanged records that ends it early
+INFERENCE_SAMPLE_SIZE = config['api'].getint('inference_sample_size', fallback=1000)
+INFERENCE_STABLE_AFTER = config['api'].getint('inference_stable_after', fallback=100)
 
-def filter_results(records):
+class EsoApiClient:
     """
-    Filter records to include only those for the current day based on the deliveryEnd field.
+    Reusable HTTP client for the ESO CKAN API.
+
+    Requests go through one pooled requests.Session, so keep-alive connections
+    are reused across pages and resources. Connection errors and retryable
+    statuses are retried with exponential backoff and full jitter.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, pool_size=10, connect_timeout=10.0, read_timeout=120.0,
+                 max_retries=3, backoff_factor=0.5, backoff_max=30.0, cache=None):
+        """
+        Parameters:
+        pool_size (int): Keep-alive connections kept per host.
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait between bytes of the response.
+        max_retries (int): Retries after the first attempt.
+        backoff_factor (float): Base of the backoff, doubled on every retry.
+        backoff_max (float): Upper bound of a single backoff in seconds.
+        cache (api.response_cache.ResponseCache): Optional disk cache for responses.
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.cache = cache
+
+    @classmethod
+    def from_config(cls, section):
+        """
+        Build a client from a config.ini section, using the defaults for missing keys.
+
+        Parameters:
+        section (configparser.SectionProxy): The section holding the client settings.
+
+        Returns:
+        EsoApiClient: The configured client.
+        """
+        return cls(
+            pool_size=section.getint('pool_size', fallback=10),
+            connect_timeout=section.getfloat('connect_timeout', fallback=10.0),
+            read_timeout=section.getfloat('read_timeout', fallback=120.0),
+            max_retries=section.getint('max_retries', fallback=3),
+            backoff_factor=section.getfloat('backoff_factor', fallback=0.5),
+            cache=ResponseCache.from_config(section),
+        )
+
+    def backoff(self, attempt):
+        """
+        Seconds to sleep before retry number attempt (0-based), with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+    def post(self, url, payload, stream=False, cache=True):
+        """
+        POST a JSON payload, retrying connection errors and retryable statuses.
+
+        With a cache, fresh entries are served without a request, stale ones are
+        revalidated with a conditional request and 200 responses are stored.
+
+        Parameters:
+        url (str): The endpoint.
+        payload (dict): The JSON body of the request.
+        stream (bool): Leave the body unread so it can be streamed.
+        cache (bool): Use the cache, if the client has one.
+
+        Returns:
+        requests.Response: The first non-retryable response, or the last one once retries are exhausted.
+        """
+        data = json.dumps(payload, sort_keys=True)
+        if self.cache is None or not cache:
+            return self._send(url, data, stream)
+
+        key = self.cache.key(url, data)
+        entry = self.cache.lookup(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.count(hit=True)
+            return self.cache.response(key, entry, stream)
+
+        headers = self.cache.conditional_headers(entry) if entry is not None else {}
+        response = self._send(url, data, stream=True, headers=headers)
+        if entry is not None and response.status_code == 304:
+            response.close()
+            self.cache.refresh(key, entry)
+            self.cache.count(hit=True)
+            return self.cache.response(key, entry, stream)
+
+        self.cache.count(hit=False)
+        if response.status_code != 200:
+            return response
+        entry = self.cache.store(key, response)
+        self.cache.evict(keep=key)
+        return self.cache.response(key, entry, stream)
+
+    def _send(self, url, data, stream=False, headers=None):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, data=data, headers=headers, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Request to {url} failed ({e}), retry {attempt + 1}/{self.max_retries}")
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                response.close()
+                logging.warning(f"Request to {url} returned HTTP {response.status_code}, "
+                                f"retry {attempt + 1}/{self.max_retries}")
+            time.sleep(self.backoff(attempt))
+
+    def close(self):
+        self.session.close()
+
+# Shared by every request of the process
+api_client = EsoApiClient.from_config(config['api'])
+
+# Identical actions requested concurrently (e.g. by resources with the same filters) share one request
+_in_flight = SingleFlight()
+
+def filter_results(records, start_date=None, end_date=None):
+    """
+    Filter records to include only those for the given days based on the deliveryEnd field.
+
+    The date window is already applied by the API query; this is a safety net
+    for rows the server should not have returned.
 
     Parameters:
-    records (list): List of records to be filtered.
+    records (iterable): Records to be filtered, a list or a streaming decoder.
+    start_date (datetime.date): First day to keep, defaults to the current day.
+    end_date (datetime.date): Last day to keep, defaults to start_date.
 
     Returns:
-    list: Filtered records for the current day.
+    list: Filtered records for the requested days.
     """
-    current_date = datetime.now().date()
+    start_date = start_date or datetime.now().date()
+    end_date = end_date or start_date
     filtered_records = []
 
     for record in records:
         try:
             delivery_end = datetime.fromisoformat(record['deliveryEnd']).date()
-            if delivery_end == current_date:
+            if start_date <= delivery_end <= end_date:
                 filtered_records.append(record)
         except Exception as e:
             logging.error(f"Error processing record {record}: {e}")
     
     return filtered_records
 
-def fetch_auction_results(participant_name):
-    try:
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            "resource_id": RESOURCE_ID,
-            "limit": LIMIT,
-            "filters": {
-                "registeredAuctionParticipant": participant_name
-            }
-        }
+def _sql_literal(value):
+    """
+    Render a Python value as a literal for a datastore_search_sql query.
+
+    Parameters:
+    value (int, float or str): The value to render.
+
+    Returns:
+    str: The SQL literal.
+    """
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def delivery_end_range(start_date=None, end_date=None):
+    """
+    Build the server-side deliveryEnd window for the given days.
+
+    Parameters:
+    start_date (datetime.date): First day of the window, defaults to the current day.
+    end_date (datetime.date): Last day of the window, defaults to start_date.
+
+    Returns:
+    dict: {'deliveryEnd': (lower bound inclusive, upper bound exclusive)} as ISO strings.
+    """
+    start_date = start_date or datetime.now().date()
+    end_date = end_date or start_date
+    return {"deliveryEnd": (start_date.isoformat(), (end_date + timedelta(days=1)).isoformat())}
+
+def _where_clause(filters, after_id, ranges=None, until_id=None):
+    conditions = [f'"_id" > {int(after_id)}']
+    if until_id is not None:
+        conditions.append(f'"_id" <= {int(until_id)}')
+    for field, value in filters.items():
+        conditions.append(f'"{field}" = {_sql_literal(value)}')
+    for field, (lower, upper) in (ranges or {}).items():
+        conditions.append(f'"{field}" >= {_sql_literal(lower)}')
+        conditions.append(f'"{field}" < {_sql_literal(upper)}')
+    return " AND ".join(conditions)
+
+def project_fields(fields):
+    """
+    Complete a configured field list with the mandatory fields.
+
+    Parameters:
+    fields (iterable): The configured field names, or None for every field.
+
+    Returns:
+    tuple: Mandatory fields followed by the others without duplicates, or None for every field.
+    """
+    if not fields:
+        return None
+    return tuple(dict.fromkeys((*MANDATORY_FIELDS, *fields)))
+
+def build_page_query(resource_id, filters, after_id, page_size, ranges=None, until_id=None, fields=None):
+    """
+    Build the SQL for one keyset page: the next page_size rows with _id above after_id.
+
+    Parameters:
+    resource_id (str): The datastore resource to query.
+    filters (dict): Field names and values the rows must equal.
+    after_id (int): The last _id already seen (the cursor).
+    page_size (int): Maximum number of rows in the page.
+    ranges (dict): Field names and (lower inclusive, upper exclusive) bounds.
+    until_id (int): Optional inclusive upper bound on _id.
+    fields (iterable): Columns to select (the mandatory ones are added), None for all.
+
+    Returns:
+    str: The SQL statement.
+    """
+    fields = project_fields(fields)
+    columns = ", ".join(f'"{field}"' for field in fields) if fields else "*"
+    return (f'SELECT {columns} FROM "{resource_id}" WHERE {_where_clause(filters, after_id, ranges, until_id)} '
+            f'ORDER BY "_id" LIMIT {int(page_size)}')
+
+def build_count_query(resource_id, filters, after_id, ranges=None):
+    """
+    Build the SQL returning the total, lowest and highest _id of the matching rows.
+
+    Parameters:
+    resource_id (str): The datastore resource to query.
+    filters (dict): Field names and values the rows must equal.
+    after_id (int): Only rows with an _id above this are counted.
+    ranges (dict): Field names and (lower inclusive, upper exclusive) bounds.
+
+    Returns:
+    str: The SQL statement.
+    """
+    return (f'SELECT COUNT(*) AS total, MIN("_id") AS min_id, MAX("_id") AS max_id '
+            f'FROM "{resource_id}" WHERE {_where_clause(filters, after_id, ranges)}')
+
+def _post_action(url, payload, cache=True):
+    """
+    POST a CKAN action and return its result, raising on HTTP or API errors.
+
+    Callers asking for the same action while it is in flight get the result
+    of that request instead of sending their own.
+
+    Parameters:
+    url (str): The action endpoint.
+    payload (dict): The JSON body of the request.
+    cache (bool): Allow the response cache to answer.
+
+    Returns:
+    dict: The 'result' member of the response.
+    """
+    key = (url, json.dumps(payload, sort_keys=True), cache)
+    return _in_flight.do(key, _send_action, url, payload, cache)
+
+def _send_action(url, payload, cache):
+    response = api_client.post(url, payload, cache=cache)
 
-        response = requests.post(API_URL, headers=headers, data=json.dumps(data))
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
 
+    response_dict = response.json()
+    if not response_dict.get('success', False):
+        error_message = response_dict.get('error', {}).get('message', 'Unknown error')
+        raise Exception(f"API Error: {error_message}")
+
+    return response_dict['result']
+
+def _stream_action_records(url, payload, result=None, cache=True):
+    """
+    POST a CKAN action and decode its result.records one record at a time.
+
+    Parameters:
+    url (str): The action endpoint.
+    payload (dict): The JSON body of the request.
+    result (dict): Receives the other members of the result once the records are read.
+    cache (bool): Allow the response cache to answer.
+
+    Yields:
+    dict: Each record of the response.
+    """
+    response = api_client.post(url, payload, stream=True, cache=cache)
+    envelope = {}
+    try:
         if response.status_code != 200:
             raise Exception(f"Failed to fetch data: HTTP {response.status_code}")
+        yield from iter_records(response.iter_content(chunk_size=STREAM_CHUNK_SIZE), envelope)
+    finally:
+        response.close()
+
+    if not envelope.get('success', False):
+        error_message = envelope.get('error', {}).get('message', 'Unknown error')
+        raise Exception(f"API Error: {error_message}")
+    if result is not None:
+        result.update(envelope.get('result', {}))
+
+def _iter_action_records(url, payload, stream=None, result=None, cache=True):
+    """
+    POST a CKAN action and yield its records without the datastore's _full_text search column.
+
+    Parameters:
+    url (str): The action endpoint.
+    payload (dict): The JSON body of the request.
+    stream (bool): Decode the response incrementally, defaults to STREAM_RESPONSES.
+    result (dict): Receives the other members of the result (fields, total, ...)
+        once the records are read.
+    cache (bool): Allow the response cache to answer.
+
+    Yields:
+    dict: Each record of the response.
+    """
+    stream = STREAM_RESPONSES if stream is None else stream
+    if stream:
+        records = _stream_action_records(url, payload, result, cache)
+    else:
+        response_result = _post_action(url, payload, cache)
+        records = response_result['records']
+        if result is not None:
+            result.update((key, value) for key, value in response_result.items() if key != 'records')
+    for record in records:
+        record.pop('_full_text', None)  # search index column returned by SELECT *, not data
+        yield record
+
+def _declared_types(result, schema):
+    """
+    Copy the column types a response declares in result.fields into schema.
+    """
+    if schema is not None and not schema:
+        schema.update((field['id'], field['type']) for field in result.get('fields', [])
+                      if field['id'] != '_full_text')
+
+def _fetch_pages(resource_id, filters, page_size, after_id, ranges=None, until_id=None, fields=None,
+                 schema=None, cache=True):
+    """
+    Keyset-paginate the rows with after_id < _id <= until_id, raising on any error.
+
+    Yields:
+    list: The records of each page.
+    """
+    while True:
+        sql = build_page_query(resource_id, filters, after_id, page_size, ranges, until_id, fields)
+        result = {}
+        records = list(_iter_action_records(SQL_API_URL, {"sql": sql}, result=result, cache=cache))
+        _declared_types(result, schema)
+        if not records:
+            return
+        yield records
+        if len(records) < page_size:
+            return
+        after_id = records[-1]['_id']
+
+def _fetch_shard(resource_id, filters, page_size, after_id, until_id, ranges, fields, schema, cache):
+    return list(_fetch_pages(resource_id, filters, page_size, after_id, ranges, until_id, fields, schema, cache))
+
+def _iter_pages_parallel(resource_id, filters, page_size, after_id, ranges, concurrency, fields=None,
+                         schema=None, cache=True):
+    """
+    Fetch the pages concurrently, split into _id shards sized from the row count.
 
-        response_dict = response.json()
-        if not response_dict.get('success', False):
-            error_message = response_dict.get('error', {}).get('message', 'Unknown error')
-            raise Exception(f"API Error: {error_message}")
+    A first request returns the number of matching rows and their _id range;
+    that range is split into roughly one shard per page and the shards are
+    fetched on a thread pool. Shards are yielded in _id order, with at most
+    2 * concurrency of them downloaded ahead of the consumer.
+
+    Yields:
+    list: The records of each page, in _id order.
+    """
+    sql = build_count_query(resource_id, filters, after_id, ranges)
+    stats = _post_action(SQL_API_URL, {"sql": sql}, cache)['records'][0]
+    total = int(stats['total'] or 0)
+    if total <= page_size:
+        yield from _fetch_pages(resource_id, filters, page_size, after_id, ranges, fields=fields, schema=schema,
+                                cache=cache)
+        return
+
+    lower = max(after_id, int(stats['min_id']) - 1)
+    upper = int(stats['max_id'])
+    width = math.ceil((upper - lower) / math.ceil(total / page_size))
+    shards = [(start, min(start + width, upper)) for start in range(lower, upper, width)]
+    logging.info(f"Fetching {total} records of resource {resource_id} in {len(shards)} shards "
+                 f"with {concurrency} concurrent requests")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        try:
+            for shard in shards:
+                pending.append(executor.submit(_fetch_shard, resource_id, filters, page_size, *shard, ranges,
+                                               fields, schema, cache))
+                if len(pending) < 2 * concurrency:
+                    continue
+                yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # Stop at the first failed shard: later shards must not be saved past a gap
+            for future in pending:
+                future.cancel()
+
+def _log_fetch_error(e, what):
+    if isinstance(e, requests.RequestException):
+        logging.error(f"Network error occurred while fetching {what}: {e}")
+    elif isinstance(e, json.JSONDecodeError):
+        logging.error(f"JSON decoding error occurred while fetching {what}: {e}")
+    else:
+        logging.error(f"An error occurred while fetching {what}: {e}")
+
+def iter_auction_pages(participant_name, page_size=PAGE_SIZE, after_id=0, ranges=None, resource_id=RESOURCE_ID,
+                       concurrency=1, raise_errors=False, fields=None, schema=None, cache=True):
+    """
+    Walk the participant's records in _id order, one page per request.
 
-        return filter_results(response_dict['result']['records'])
+    Each page is requested with a keyset cursor ("_id" > last seen _id) through
+    datastore_search_sql, so every request costs the same however deep into the
+    resource it is. With concurrency above 1 the pages are fetched in parallel
+    and still yielded in _id order. Errors are logged and end the iteration,
+    or are re-raised with raise_errors.
+
+    Parameters:
+    participant_name (str): The registered auction participant to fetch.
+    page_size (int): Number of records per request.
+    after_id (int): Only records with an _id above this are fetched.
+    ranges (dict): Optional server-side range filters, see build_page_query.
+    resource_id (str): The datastore resource to fetch.
+    concurrency (int): Maximum number of concurrent page requests.
+    raise_errors (bool): Re-raise errors after logging them.
+    fields (iterable): Fields to fetch (plus MANDATORY_FIELDS), None for all.
+    schema (dict): Receives the column types declared by the API (field name to
+        CKAN type) once the first page has been fetched.
+    cache (bool): Allow the response cache to answer the count and page requests.
+
+    Yields:
+    list: The unfiltered records of each page.
+    """
+    filters = {"registeredAuctionParticipant": participant_name}
+    try:
+        if concurrency > 1:
+            yield from _iter_pages_parallel(resource_id, filters, page_size, after_id, ranges, concurrency, fields,
+                                            schema, cache)
+        else:
+            yield from _fetch_pages(resource_id, filters, page_size, after_id, ranges, fields=fields, schema=schema,
+                                    cache=cache)
+
+    except Exception as e:
+        _log_fetch_error(e, f"auction results pages of resource {resource_id}")
+        if raise_errors:
+            raise
+
+def iter_auction_results(participant_name, page_size=PAGE_SIZE, start_date=None, end_date=None, after_id=0,
+                         resource_id=RESOURCE_ID, concurrency=1, raise_errors=False, fields=None, schema=None,
+                         cache=True):
+    """
+    Yield the records delivered between start_date and end_date page by page.
+
+    Parameters:
+    participant_name (str): The registered auction participant to fetch.
+    page_size (int): Number of records per request.
+    start_date (datetime.date): First deliveryEnd day, defaults to the current day.
+    end_date (datetime.date): Last deliveryEnd day, defaults to start_date.
+    after_id (int): Only records with an _id above this (the stored high-watermark) are fetched.
+    resource_id (str): The datastore resource to fetch.
+    concurrency (int): Maximum number of concurrent page requests.
+    raise_errors (bool): Re-raise fetch errors after logging them.
+    fields (iterable): Fields to fetch (plus MANDATORY_FIELDS), None for all.
+    schema (dict): Receives the column types declared by the API, see iter_auction_pages.
+    cache (bool): Allow the response cache to answer the requests.
+
+    Yields:
+    list: Filtered records of each page (may be empty).
+    """
+    ranges = delivery_end_range(start_date, end_date)
+    for page in iter_auction_pages(participant_name, page_size, after_id, ranges, resource_id, concurrency,
+                                   raise_errors, fields, schema, cache):
+        yield filter_results(page, start_date, end_date)
+
+def fetch_auction_results(participant_name, start_date=None, end_date=None, after_id=0,
+                          resource_id=RESOURCE_ID, limit=LIMIT, raise_errors=False, fields=None, schema=None,
+                          cache=True):
+    try:
+        # The deliveryEnd window is pushed down to the server, so only the
+        # requested days are transferred
+        sql = build_page_query(
+            resource_id,
+            {"registeredAuctionParticipant": participant_name},
+            after_id,
+            limit,
+            delivery_end_range(start_date, end_date),
+            fields=fields,
+        )
+
+        # Records are filtered as they are decoded, so only the kept ones stay in memory
+        result = {}
+        records = _iter_action_records(SQL_API_URL, {"sql": sql}, result=result, cache=cache)
+        records = filter_results(records, start_date, end_date)
+        _declared_types(result, schema)
+        return records
     
-    except requests.RequestException as e:
-        logging.error(f"Network error occurred while fetching auction results: {e}")
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON decoding error occurred while fetching auction results: {e}")
     except Exception as e:
-        logging.error(f"An error occurred while fetching auction results: {e}")
+        _log_fetch_error(e, "auction results")
+        if raise_errors:
+            raise
     
     return []
 
-def detect_fields(records):
+def fetch_resource_fingerprint(resource_id=RESOURCE_ID):
+    """
+    Get a cheap marker of the resource's last upstream change from resource_show.
+
+    The call bypasses the response cache so a cached answer never hides a change.
+
+    Parameters:
+    resource_id (str): The resource to look up.
+
+    Returns:
+    str: The resource's last_modified (or metadata_modified) timestamp, or None if unavailable.
+    """
+    try:
+        result = _post_action(RESOURCE_SHOW_URL, {"id": resource_id}, cache=False)
+        return result.get('last_modified') or result.get('metadata_modified')
+    except Exception as e:
+        _log_fetch_error(e, f"metadata of resource {resource_id}")
+        return None
+
+def detect_fields(records, fields=None, schema=None, sample_size=INFERENCE_SAMPLE_SIZE):
     """
     Detect the fields and their types in the records.
 
+    Column types declared by the API are mapped directly. Fields the schema
+    leaves untyped are inferred from a sample of the records, widening the type
+    as values are seen (see utils.type_inference.infer_field_kinds).
+
     Parameters:
-    records (list): List of records to detect fields from.
+    records (list or iterable): Records to detect fields from.
+    fields (iterable): Only detect these fields (plus MANDATORY_FIELDS), None for all.
+    schema (dict): Field names and their CKAN types, as reported in result.fields.
+    sample_size (int): Maximum number of records inspected for inference.
 
     Returns:
     dict: Dictionary with field names as keys and SQLAlchemy types as values.
     """
-    if not records:
+    if not records and not schema:
         return {}
+
+    # Imported here so the metadata fast path in main.py never loads SQLAlchemy
+    import sqlalchemy
     
     field_types = {}
+    projection = project_fields(fields)
+
+    for key, ckan_type in (schema or {}).items():
+        if (projection is None or key in projection) and ckan_type in CKAN_TYPES:
+            field_types[key] = getattr(sqlalchemy, CKAN_TYPES[ckan_type])
+
+    # Rows of one response share its declared columns: when the first one is
+    # fully typed there is nothing left to infer
+    if isinstance(records, list) and records and all(key in field_types for key in records[0]
+                                                     if projection is None or key in projection):
+        return field_types
+
+    kinds = infer_field_kinds(records, sample_size, INFERENCE_STABLE_AFTER)
+    for key, kind in kinds.items():
+        if (projection is None or key in projection) and key not in field_types:
+            field_types[key] = getattr(sqlalchemy, KIND_TYPES[kind])
     
-    for record in records:
-        for key, value in record.items():
-            if key not in field_types:
-                if isinstance(value, int):
-                    field_types[key] = Integer
-                elif isinstance(value, float):
-                    field_types[key] = Float
-                elif isinstance(value, bool):
-                    field_types[key] = Boolean
-                elif isinstance(value, str) and is_datetime(value):
-                    field_types[key] = DateTime
-                elif isinstance(value, str):
-                    field_types[key] = String
-                else:
-                    field_types[key] = String  # Default to String for any unknown types
-    
-    return field_types
\ No newline at end of file
+    return field_types
@@ -0,0 +1,139 @@
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+class _Reader:
+    """
+    Text buffer over an iterable of byte (or str) chunks.
+
+    Only the unconsumed tail of the input is kept, so memory is bounded by the
+    chunk size plus the largest single value decoded.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Append the next non-empty chunk to the buffer.
+
+        Returns:
+        bool: False once the input is exhausted.
+        """
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                self.buffer += text
+                return True
+        self.buffer += self._text_decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, or '' at the end of the input.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        """
+        Consume the next non-whitespace character, which must be char.
+        """
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode the next complete JSON value, reading more input as needed.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number or literal that runs into the end of the buffer may be truncated
+            if end == len(self.buffer) and self.buffer[end - 1] not in '}]"' and self.fill():
+                continue
+            self.pos = end
+            return value
+
+def _iter_keys(reader):
+    """
+    Yield the keys of the object whose '{' was just consumed.
+
+    The caller must consume each key's value before asking for the next key.
+    """
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        yield key
+        char = reader.peek()
+        reader.pos += 1
+        if char == '}':
+            return
+        if char != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", reader.buffer, reader.pos - 1)
+
+def iter_records(chunks, envelope=None):
+    """
+    Incrementally decode a CKAN action response, yielding result.records one at a time.
+
+    Only one record is held as a Python object at any time. Every other member
+    of the response (success, error, result.total, result.fields, ...) is
+    decoded normally and stored in envelope.
+
+    Parameters:
+    chunks (iterable): The response body as byte or str chunks, e.g. response.iter_content().
+    envelope (dict): Receives the response without its records.
+
+    Yields:
+    dict: Each record of result.records.
+    """
+    envelope = {} if envelope is None else envelope
+    reader = _Reader(chunks)
+    reader.expect('{')
+    for key in _iter_keys(reader):
+        if key != 'result' or reader.peek() != '{':
+            envelope[key] = reader.value()
+            continue
+        result = envelope.setdefault('result', {})
+        reader.expect('{')
+        for result_key in _iter_keys(reader):
+            if result_key != 'records' or reader.peek() != '[':
+                result[result_key] = reader.value()
+                continue
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+                continue
+            while True:
+                yield reader.value()
+                char = reader.peek()
+                reader.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", reader.buffer, reader.pos - 1)
@@ -0,0 +1,230 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+class _BodyFile(io.FileIO):
+    """
+    Cached body used as a Response's raw stream; closed by Response.close().
+    """
+
+    def release_conn(self):
+        self.close()
+
+class ResponseCache:
+    """
+    Local, size-bounded disk cache for API responses.
+
+    Entries are keyed by the request URL and body (for datastore_search_sql the
+    SQL holds the resource_id, filters and page cursor). An entry whose response
+    carried an ETag or Last-Modified header is revalidated with a conditional
+    request on every use; an entry without validators is served for ttl seconds.
+    The least recently used entries are evicted once the bodies exceed max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 2 ** 20, ttl=3600.0):
+        """
+        Parameters:
+        directory (str): Where the cached bodies are stored, created if missing.
+        max_bytes (int): Upper bound of the total size of the cached bodies.
+        ttl (float): Seconds an entry without validators stays fresh.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, section):
+        """
+        Build a cache from a config.ini section, or None when cache_dir is not set.
+
+        Parameters:
+        section (configparser.SectionProxy): The section holding the cache settings.
+
+        Returns:
+        ResponseCache: The configured cache, or None.
+        """
+        directory = section.get('cache_dir', fallback='')
+        if not directory:
+            return None
+        return cls(
+            directory,
+            max_bytes=section.getint('cache_max_mb', fallback=256) * 2 ** 20,
+            ttl=section.getfloat('cache_ttl', fallback=3600.0),
+        )
+
+    @staticmethod
+    def key(url, data):
+        """
+        Cache key of a request.
+
+        Parameters:
+        url (str): The endpoint.
+        data (str): The serialized request body.
+
+        Returns:
+        str: Hex digest identifying the request.
+        """
+        return hashlib.sha256(f"{url}\n{data}".encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return f"{base}.body", f"{base}.json"
+
+    def lookup(self, key):
+        """
+        Get the metadata of a cached entry and mark it as recently used.
+
+        Returns:
+        dict: The entry's metadata, or None if it is not cached.
+        """
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as meta_file:
+                entry = json.load(meta_file)
+            os.utime(body_path)  # the body's mtime orders entries for LRU eviction
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        Whether an entry can be used without asking the server.
+
+        Entries with validators are always revalidated; others expire after ttl.
+        """
+        if entry.get('etag') or entry.get('last_modified'):
+            return False
+        return time.time() - entry['stored_at'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Headers turning a request into a revalidation of the entry.
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _write_meta(self, key, entry):
+        meta_path = self._paths(key)[1]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as meta_file:
+            json.dump(entry, meta_file)
+        os.replace(tmp_path, meta_path)
+
+    def refresh(self, key, entry):
+        """
+        Record a successful revalidation (HTTP 304) of an entry.
+        """
+        entry['stored_at'] = time.time()
+        self._write_meta(key, entry)
+
+    def store(self, key, response):
+        """
+        Write a 200 response's body to the cache, reading it in chunks, and close the response.
+
+        Returns:
+        dict: The new entry's metadata.
+        """
+        body_path = self._paths(key)[0]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as body_file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    body_file.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        finally:
+            response.close()
+        os.replace(tmp_path, body_path)
+
+        entry = {
+            'url': response.url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'size': os.path.getsize(body_path),
+        }
+        self._write_meta(key, entry)
+        return entry
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the bodies fit in max_bytes.
+
+        Parameters:
+        keep (str): Key of an entry that must not be removed.
+        """
+        with self._lock:
+            bodies = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.body'):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    bodies.append((stat.st_mtime, stat.st_size, name[:-len('.body')]))
+            total = sum(size for _, size, _ in bodies)
+            for _, size, key in sorted(bodies):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                logging.info(f"Evicted cached response {key}")
+
+    def response(self, key, entry, stream=False):
+        """
+        Build a requests.Response serving a cached body.
+
+        Parameters:
+        key (str): The entry's key.
+        entry (dict): The entry's metadata.
+        stream (bool): Serve the body from the file instead of loading it.
+
+        Returns:
+        requests.Response: A 200 response with the cached body.
+        """
+        body_path = self._paths(key)[0]
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response.encoding = 'utf-8'
+        if stream:
+            response.raw = _BodyFile(body_path)
+        else:
+            with open(body_path, 'rb') as body_file:
+                response._content = body_file.read()
+        return response
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """
+        Returns:
+        dict: Hit and miss counts since the cache was created.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
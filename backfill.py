@@ -0,0 +1,371 @@
+"""
+Backfill auction results for a range of delivery days.
+
+The range is split into day or week shards that are fetched, filtered and
+converted on a process pool; the rows of every shard are written by the
+single writer thread of their database.
+
+Usage:
+    python backfill.py --from 2024-01-01 --until 2024-12-31 [--shard week] [--workers 8] [--resource NAME]
+"""
+import argparse
+import configparser
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import replace
+from datetime import date, timedelta
+from functools import lru_cache
+from itertools import chain
+
+from utils.resources import load_resources
+from utils.utils import peek
+
+# Configure logging
+logging.basicConfig(filename='logs.log', level=logging.INFO,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+# Load configuration
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# Days covered by one shard
+SHARD_DAYS = {'day': 1, 'week': 7}
+
+# How often a distributed backfill with no claimable shard checks for shards of crashed workers (seconds)
+POLL_SECONDS = 10
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill ESO auction results for a range of delivery days.")
+    parser.add_argument('--from', dest='start', type=date.fromisoformat, required=True,
+                        help="first deliveryEnd day (YYYY-MM-DD)")
+    parser.add_argument('--until', dest='end', type=date.fromisoformat,
+                        help="last deliveryEnd day (YYYY-MM-DD), defaults to --from")
+    parser.add_argument('--shard', choices=SHARD_DAYS, default='day',
+                        help="days fetched by one worker task")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument('--resource', action='append',
+                        help="only backfill this [resource:<name>] section (repeatable)")
+    parser.add_argument('--distributed', action='store_true',
+                        help="share the shards with backfills running on other hosts through the ingest_jobs table")
+    parser.add_argument('--restart', action='store_true',
+                        help="fetch every shard again, ignoring the checkpoints of earlier runs")
+    args = parser.parse_args(argv)
+    args.end = args.end or args.start
+    if args.end < args.start:
+        parser.error("--until is before --from")
+    return args
+
+def date_shards(start, end, shard='day'):
+    """
+    Split a range of days into shards.
+
+    Parameters:
+    start (datetime.date): First day of the range.
+    end (datetime.date): Last day of the range, inclusive.
+    shard (str): 'day' or 'week'.
+
+    Returns:
+    list: (first day, last day) of each shard, both inclusive.
+    """
+    step = timedelta(days=SHARD_DAYS[shard])
+    shards = []
+    while start <= end:
+        shards.append((start, min(start + step - timedelta(days=1), end)))
+        start += step
+    return shards
+
+def create_table(resource, start, end):
+    """
+    Load the resource's table, creating it from the first records of the range if needed.
+
+    Parameters:
+    resource (utils.resources.Resource): The resource to backfill.
+    start (datetime.date): First day of the range.
+    end (datetime.date): Last day of the range.
+
+    Returns:
+    sqlalchemy.Table: The table, or None if the range holds no records for a new table.
+    """
+    from sqlalchemy import inspect
+    from api.fetch_data import detect_fields, INFERENCE_SAMPLE_SIZE
+    from db.dynamic_schema import create_dynamic_table, get_engine
+    from pipeline import iter_pages
+
+    db_engine = get_engine(resource.database_url)
+    fields = {}
+    if not inspect(db_engine).has_table(resource.table_name):
+        schema = {}
+        pages = iter_pages(replace(resource, fetch_concurrency=1), 0, resource.fetch_fields, schema, start, end)
+        head, _ = peek(chain.from_iterable(pages), INFERENCE_SAMPLE_SIZE)
+        if not head:
+            return None
+        fields = detect_fields(head, resource.fetch_fields, schema)
+    return create_dynamic_table(fields, resource.table_name, db_engine, resource.upsert, resource.dedupe_key)
+
+@lru_cache(maxsize=None)
+def _worker_table(resource):
+    from db.dynamic_schema import create_dynamic_table, get_engine
+
+    # Created by the parent process before any shard is dispatched
+    return create_dynamic_table({}, resource.table_name, get_engine(resource.database_url), resource.upsert,
+                                resource.dedupe_key)
+
+def shard_run_id(resource, start, end):
+    """
+    Identify the backfill of one shard in the ingest_checkpoints table.
+    """
+    return f"backfill:{resource.resource_id}:{resource.table_name}:{start}:{end}"
+
+def fetch_shard(resource, start, end, after_id=0):
+    """
+    Fetch, filter and convert the records of one shard; runs in a worker process.
+
+    Parameters:
+    resource (utils.resources.Resource): The resource to fetch.
+    start (datetime.date): First deliveryEnd day of the shard.
+    end (datetime.date): Last deliveryEnd day of the shard.
+    after_id (int): Only fetch records above this _id, where an interrupted backfill of the shard stopped.
+
+    Returns:
+    list: The shard's rows, ready for save_rows.
+    """
+    from db.dynamic_schema import compile_row_preparer
+    from pipeline import iter_pages
+
+    prepare = compile_row_preparer(_worker_table(resource), resource.upsert)
+    pages = iter_pages(resource, after_id, resource.fetch_fields, {}, start, end)
+    return [prepare(record) for page in pages for record in page]
+
+def save_shard(rows, table, db_engine, resource, start, end, after_id=0):
+    """
+    Save the rows of one shard, committing a checkpoint with every batch; runs on the writer thread.
+
+    Returns:
+    SaveCounts: The number of rows inserted, updated and skipped.
+    """
+    from db.dynamic_schema import finish_checkpoint, save_rows
+    from pipeline import checkpointer
+
+    run_id = shard_run_id(resource, start, end)
+    counts = save_rows(rows, table, db_engine, resource.batch_size, resource.upsert, resource.dedupe_key,
+                       checkpointer(run_id, resource, after_id))
+    finish_checkpoint(run_id, resource.resource_id, max([after_id] + [row['_id'] for row in rows]), db_engine)
+    return counts
+
+class LocalShards:
+    """
+    The shards of one backfill run, handed out in order to this process only.
+    """
+
+    def __init__(self, tasks):
+        self._tasks = iter(tasks)
+
+    def claim(self):
+        return next(self._tasks, None)
+
+    def finish(self, task, succeeded):
+        # Returns whether the shard is given up
+        return not succeeded
+
+    def waiting(self):
+        return False
+
+    def close(self):
+        pass
+
+class LeasedShards:
+    """
+    Shards shared with other backfill workers through the ingest_jobs table of each database.
+
+    Every worker enqueues the shards of its range (already enqueued ones are
+    kept) and claims shards within that range one at a time under a lease, renewed while the
+    shard is fetched and written. Shards of crashed workers are claimed again
+    once their lease expires; a shard is given up after MAX_ATTEMPTS failures.
+    """
+
+    def __init__(self, resources, start, end, shard, owner=None):
+        from db import jobs
+        from db.dynamic_schema import get_engine
+
+        self._jobs = jobs
+        self.owner = owner or jobs.worker_id()
+        self._resources = {resource.name: resource for resource in resources}
+        self._range = (start, end)
+        self._databases = {}
+        for resource in resources:
+            db_engine = get_engine(resource.database_url)
+            jobs.enqueue_jobs(db_engine, resource.name, date_shards(start, end, shard))
+            self._databases.setdefault(resource.database_url, (db_engine, []))[1].append(resource.name)
+        self._renewer = jobs.LeaseRenewer(self.owner)
+
+    def claim(self):
+        for db_engine, names in self._databases.values():
+            job = self._jobs.claim_job(db_engine, self.owner, names, within=self._range)
+            if job is not None:
+                self._renewer.hold(job, db_engine)
+                return (self._resources[job.resource], job.shard_start, job.shard_end, (job, db_engine))
+        return None
+
+    def finish(self, task, succeeded):
+        job, db_engine = task[3]
+        self._renewer.drop(job)
+        if self._renewer.lost(job):
+            logging.warning(f"Lease of {job.resource} {job.shard_start}..{job.shard_end} was lost, not completing it")
+            return False
+        if succeeded:
+            self._jobs.complete_job(db_engine, job, self.owner)
+            return False
+        self._jobs.release_job(db_engine, job, self.owner, failed=True)
+        return job.attempts >= self._jobs.MAX_ATTEMPTS
+
+    def waiting(self):
+        # Shards leased by other workers may still come back if those workers crash
+        return any(self._jobs.count_unfinished(db_engine, names, self._range)
+                   for db_engine, names in self._databases.values())
+
+    def close(self):
+        self._renewer.close()
+
+def backfill(resources, start, end, shard='day', workers=None, executor=None, distributed=False, resume=True):
+    """
+    Fetch and save the records of the given resources delivered between start and end.
+
+    Shards are handed to the worker processes a few at a time, so the rows
+    waiting for the writer stay bounded. The high-watermark of incremental
+    syncs is not changed; records already stored are skipped by the dedupe key.
+
+    Each shard commits a checkpoint with every batch. Running the same
+    backfill again skips the shards already done and resumes interrupted
+    ones after their last committed record.
+
+    Parameters:
+    resources (list): The resources to backfill.
+    start (datetime.date): First deliveryEnd day.
+    end (datetime.date): Last deliveryEnd day, inclusive.
+    shard (str): 'day' or 'week'.
+    workers (int): Number of worker processes, defaults to the number of CPUs.
+    executor (concurrent.futures.Executor): Runs fetch_shard, defaults to a process pool.
+    distributed (bool): Share the shards with other hosts through the ingest_jobs table, see LeasedShards.
+    resume (bool): Skip or resume shards from the checkpoints of earlier runs.
+
+    Returns:
+    list: (resource name, first day, last day) of each shard that failed.
+    """
+    from db.dynamic_schema import get_checkpoint, get_engine, DONE
+    from db.writer import get_writer
+
+    workers = workers or os.cpu_count()
+    tables = {}
+    failed = []
+    for resource in resources:
+        try:
+            tables[resource] = create_table(resource, start, end)
+        except Exception as e:
+            logging.error(f"Error preparing the table of resource {resource.name}: {e}")
+            failed += [(resource.name, *days) for days in date_shards(start, end, shard)]
+            continue
+        if tables[resource] is None:
+            logging.info(f"No results between {start} and {end} for resource {resource.name}.")
+    ready = [resource for resource in resources if tables.get(resource) is not None]
+    if distributed:
+        shards = LeasedShards(ready, start, end, shard)
+    else:
+        shards = LocalShards([(resource, *days, None) for resource in ready for days in date_shards(start, end, shard)])
+
+    def on_written(write, task, finished):
+        resource, first_day, last_day, _ = task
+        try:
+            counts = write.result()
+        except Exception as e:
+            logging.error(f"Error saving {first_day}..{last_day} of resource {resource.name}: {e}")
+            if shards.finish(task, False):
+                failed.append((resource.name, first_day, last_day))
+        else:
+            logging.info(f"Backfilled {first_day}..{last_day} of resource {resource.name}: {counts}")
+            shards.finish(task, True)
+        finally:
+            finished.set_result(None)
+
+    # Set once a shard's write completed and the shard was finished
+    writes = []
+    # Spawned workers do not inherit the parent's open HTTP and database connections
+    executor = executor or ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with executor:
+            running = {}
+
+            def submit_next():
+                while True:
+                    task = shards.claim()
+                    if task is None:
+                        return
+                    resource, first_day, last_day, _ = task
+                    checkpoint = get_checkpoint(shard_run_id(resource, first_day, last_day),
+                                                get_engine(resource.database_url)) if resume else None
+                    if checkpoint is None or checkpoint.status != DONE:
+                        break
+                    logging.info(f"{first_day}..{last_day} of resource {resource.name} already backfilled")
+                    shards.finish(task, True)
+                after_id = checkpoint.cursor if checkpoint is not None else 0
+                running[executor.submit(fetch_shard, resource, first_day, last_day, after_id)] = (task, after_id)
+
+            for _ in range(2 * workers):
+                submit_next()
+            while running or shards.waiting():
+                if not running:
+                    # Shards of this worker still being written count as unfinished too
+                    writing = [write for write in writes if not write.done()]
+                    if writing:
+                        wait(writing, POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    else:
+                        time.sleep(POLL_SECONDS)
+                    submit_next()
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, after_id = running.pop(future)
+                    resource, first_day, last_day, _ = task
+                    try:
+                        rows = future.result()
+                    except Exception as e:
+                        logging.error(f"Error fetching {first_day}..{last_day} of resource {resource.name}: {e}")
+                        if shards.finish(task, False):
+                            failed.append((resource.name, first_day, last_day))
+                    else:
+                        write = get_writer(resource.database_url).submit(
+                            save_shard, rows, tables[resource], get_engine(resource.database_url), resource,
+                            first_day, last_day, after_id)
+                        finished = Future()
+                        write.add_done_callback(
+                            lambda write, task=task, finished=finished: on_written(write, task, finished))
+                        writes.append(finished)
+                    submit_next()
+        wait(writes)
+    finally:
+        shards.close()
+    return failed
+
+def main(argv=None):
+    args = parse_args(argv)
+    resources = [resource for resource in load_resources(config)
+                 if not args.resource or resource.name in args.resource]
+    if not resources:
+        print(f"No configured resource named {', '.join(args.resource)}")
+        return 1
+
+    from db.writer import close_writers
+
+    failed = backfill(resources, args.start, args.end, args.shard, args.workers, distributed=args.distributed,
+                      resume=not args.restart)
+    close_writers()
+    for name, first_day, last_day in failed:
+        print(f"Backfill of {first_day}..{last_day} failed for resource {name}, see logs.log")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
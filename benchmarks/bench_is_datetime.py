@@ -0,0 +1,64 @@
+"""
+Compare the dateutil-based datetime sniffing with utils.utils.parse_datetime.
+
+The workload mimics detect_fields + date conversion over EAC results: every
+string value is checked, and datetime values are then converted. The old path
+parses datetimes twice (dateutil, then fromisoformat); the new one parses once
+and memoises the repeating deliveryStart/deliveryEnd values.
+
+Usage:
+    python -m benchmarks.bench_is_datetime [--records 50000]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+
+from utils.utils import is_datetime, parse_datetime
+
+def old_convert(value):
+    if len(value) < 10:
+        return value
+    try:
+        parse(value)
+    except (ValueError, TypeError):
+        return value
+    return datetime.fromisoformat(value)
+
+def new_convert(value):
+    if len(value) < 10:
+        return value
+    parsed = parse_datetime(value)
+    return value if parsed is None else parsed
+
+def build_values(n_records):
+    start = datetime(2024, 8, 6, 23)
+    values = []
+    for i in range(n_records):
+        block = start + timedelta(hours=4 * (i % 6))
+        values += [
+            "HABITAT ENERGY LIMITED", "HAB6-FFR", "Response", "DCH",
+            block.isoformat(), (block + timedelta(hours=4)).isoformat(),
+            "Batteries", "TN17", f"579#||#87#||#DCH#||#{i}",
+        ]
+    return values
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=50_000)
+    args = parser.parse_args()
+
+    values = build_values(args.records)
+    print(f"{len(values)} string values from {args.records} records")
+    for name, convert in (("dateutil", old_convert), ("parse_datetime", new_convert)):
+        parse_datetime.cache_clear()
+        start = time.perf_counter()
+        converted = [convert(value) for value in values]
+        elapsed = time.perf_counter() - start
+        print(f"{name:<16}{elapsed:>8.3f}s {len(values) / elapsed / 1e6:>8.2f}M values/s")
+    assert converted == [old_convert(value) for value in values]
+    assert all(is_datetime(value) == isinstance(c, datetime) for value, c in zip(values, converted))
+
+if __name__ == '__main__':
+    main()
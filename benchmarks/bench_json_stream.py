@@ -0,0 +1,85 @@
+"""
+Compare response.json()-style decoding with the streaming decoder in api/json_stream.py.
+
+A synthetic datastore_search payload is built in memory and fed to each decoder
+in 64 KiB chunks, the way requests' iter_content delivers it. Peak memory is the
+tracemalloc peak of the decode alone (the payload bytes are excluded).
+
+Usage:
+    python -m benchmarks.bench_json_stream [--records 1000000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from api.json_stream import iter_records
+
+CHUNK_SIZE = 64 * 1024
+
+def build_payload(n_records):
+    records = ",".join(
+        json.dumps({
+            "_id": i,
+            "registeredAuctionParticipant": "HABITAT ENERGY LIMITED",
+            "auctionUnit": "HAB6-FFR",
+            "serviceType": "Response",
+            "auctionProduct": "DCH",
+            "executedQuantity": 36.0,
+            "clearingPrice": 1.58,
+            "deliveryStart": "2024-08-06T17:00:00",
+            "deliveryEnd": "2024-08-06T22:00:00",
+            "technologyType": "Batteries",
+            "postCode": "TN17",
+            "unitResultID": f"579#||#87#||#DCH#||#{i}",
+        })
+        for i in range(n_records)
+    )
+    return f'{{"success": true, "result": {{"records": [{records}], "total": {n_records}}}}}'.encode('utf-8')
+
+def chunks(payload):
+    view = memoryview(payload)
+    for start in range(0, len(payload), CHUNK_SIZE):
+        yield bytes(view[start:start + CHUNK_SIZE])
+
+def decode_whole(payload):
+    # What response.json() does: join the body, then build the full object tree
+    records = json.loads(b"".join(chunks(payload)))['result']['records']
+    for record in records:
+        yield record
+
+def decode_streaming(payload):
+    yield from iter_records(chunks(payload))
+
+def measure(decode, payload, trace):
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    records = decode(payload)
+    next(records)
+    first_record = time.perf_counter() - start
+    count = 1 + sum(1 for _ in records)
+    total = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return count, first_record, total, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    payload = build_payload(args.records)
+    print(f"payload: {args.records} records, {len(payload) / 2**20:.1f} MiB")
+    print(f"{'decoder':<12}{'first record':>14}{'total':>10}{'peak memory':>14}")
+    for name, decode in (("json.loads", decode_whole), ("streaming", decode_streaming)):
+        # Timings without tracemalloc overhead, peak memory from a second traced run
+        count, first_record, total, _ = measure(decode, payload, trace=False)
+        _, _, _, peak = measure(decode, payload, trace=True)
+        assert count == args.records
+        print(f"{name:<12}{first_record * 1000:>12.1f}ms{total:>9.2f}s{peak / 2**20:>11.1f}MiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare the per-record save_results path with the batched executemany path.
+
+The per-record path is the previous implementation: an existence SELECT and
+an ORM-executed single-row INSERT per record, committed at the end. Since
+_id is not indexed, each SELECT scans the table, so that path is measured on
+a smaller dataset by default; rows/sec is reported for both.
+
+Usage:
+    python -m benchmarks.bench_save_results [--records 100000] [--per-record 10000] [--batch-size 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, Integer, String, DateTime, Float
+from sqlalchemy.orm import sessionmaker
+
+from db.dynamic_schema import create_dynamic_table, compile_row_converter, save_results
+
+FIELDS = {
+    '_id': Integer, 'registeredAuctionParticipant': String, 'auctionUnit': String,
+    'serviceType': String, 'auctionProduct': String, 'executedQuantity': Float,
+    'clearingPrice': Float, 'deliveryStart': DateTime, 'deliveryEnd': DateTime,
+    'technologyType': String, 'postCode': String, 'unitResultID': String,
+}
+
+def build_records(n_records):
+    start = datetime(2024, 8, 6, 23)
+    records = []
+    for i in range(n_records):
+        block = start + timedelta(hours=4 * (i % 6))
+        records.append({
+            '_id': i + 1, 'registeredAuctionParticipant': "HABITAT ENERGY LIMITED",
+            'auctionUnit': f"HAB{i % 40}-FFR", 'serviceType': "Response", 'auctionProduct': "DCH",
+            'executedQuantity': i % 50, 'clearingPrice': 1.5,
+            'deliveryStart': block.isoformat(), 'deliveryEnd': (block + timedelta(hours=4)).isoformat(),
+            'technologyType': "Batteries", 'postCode': "TN17", 'unitResultID': f"579#||#87#||#DCH#||#{i}",
+        })
+    return records
+
+def save_per_record(records, table, db_engine):
+    db = sessionmaker(bind=db_engine)()
+    convert = compile_row_converter(table)
+    for record in records:
+        if not db.query(table).filter_by(_id=record['_id']).first():
+            db.execute(table.insert().values(**convert(record)))
+    db.commit()
+    db.close()
+
+def run(name, save, records, directory):
+    db_engine = create_engine(f"sqlite:///{os.path.join(directory, name)}.db")
+    table = create_dynamic_table(FIELDS, 'results', db_engine)
+    start = time.perf_counter()
+    save(records, table, db_engine)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12}{len(records):>8} rows {elapsed:>8.2f}s {len(records) / elapsed:>10.0f} rows/s")
+    db_engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=100_000)
+    parser.add_argument('--per-record', type=int, default=10_000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    records = build_records(args.records)
+    with tempfile.TemporaryDirectory() as directory:
+        run('per-record', save_per_record, records[:args.per_record], directory)
+        run('batched', lambda r, t, e: save_results(r, t, e, args.batch_size), records, directory)
+
+if __name__ == '__main__':
+    main()
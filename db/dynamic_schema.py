@@ -1,11 +1,13 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, inspect
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, MetaData, Table, Column, Index, Integer, String, DateTime, Float, bindparam, inspect, select, text, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from collections import namedtuple
 import datetime
-from dateutil.parser import parse
 import configparser
+import hashlib
 import logging
+import threading
 
-from utils.utils import is_datetime
+from utils.utils import batched, parse_datetime
 
 # Configure logging
 logging.basicConfig(filename='logs.log', level=logging.INFO,
@@ -14,83 +16,625 @@ logging.basicConfig(filename='logs.log', level=logging.INFO,
 # Load configuration
 config = configparser.ConfigParser()
 config.read('config.ini')
-RESOURCE_ID = config['api']['resource_id']
-table_name = f'auction_results_{RESOURCE_ID[:8]}'
+# Default key of the high-watermark functions; each resource passes its own
+RESOURCE_ID = config['api'].get('resource_id', fallback=None)
 
 # Database setup
 DATABASE_URL = config['database']['url']
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+BATCH_SIZE = config['database'].getint('batch_size', fallback=1000)
+
+# Columns identifying a record; enforced by a unique index on every results table
+DEDUPE_KEY = ('_id',)
+
+# Upsert mode: digest of each row's content, compared to detect revised records
+HASH_COLUMN = '_content_hash'
+HASH_SIZE = 16
+
+def _create_engine(database_url):
+    # pysqlite only emits BEGIN before DML, so a SAVEPOINT opened first starts a transaction of its
+    # own and RELEASE commits it. Let SQLAlchemy emit BEGIN instead (the documented pysqlite recipe),
+    # so batches, their savepoints and checkpoints share one transaction.
+    db_engine = create_engine(database_url)
+    if db_engine.dialect.name == 'sqlite' and db_engine.dialect.driver == 'pysqlite':
+        @event.listens_for(db_engine, 'connect')
+        def disable_pysqlite_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(db_engine, 'begin')
+        def begin_pysqlite_transaction(connection):
+            connection.exec_driver_sql('BEGIN')
+    return db_engine
+
+# Outcome of save_results
+SaveCounts = namedtuple('SaveCounts', ['inserted', 'updated', 'skipped'])
+engine = _create_engine(DATABASE_URL)
 metadata = MetaData()
 
-def create_dynamic_table(fields):
+# One engine (and connection pool) per database URL, shared by all resources stored there
+_engines = {DATABASE_URL: engine}
+_engines_lock = threading.Lock()
+
+# Highest ingested _id per resource, used by incremental syncs
+sync_state = Table(
+    'sync_state', metadata,
+    Column('resource_id', String, primary_key=True),
+    Column('high_watermark', Integer, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+# Progress of each ingest run, committed with its batches so an interrupted run can resume
+ingest_checkpoints = Table(
+    'ingest_checkpoints', metadata,
+    Column('run_id', String, primary_key=True),
+    Column('resource_id', String, nullable=False),
+    Column('cursor', Integer, nullable=False),
+    Column('last_key', String),
+    Column('status', String, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+RUNNING, DONE = 'running', 'done'
+
+# Page cursor (highest committed _id) and dedupe key (JSON) of the last committed row of a run
+Checkpoint = namedtuple('Checkpoint', ['cursor', 'last_key', 'status'])
+
+def get_engine(database_url):
+    """
+    Get the shared engine for a database URL, creating it on first use.
+
+    Parameters:
+    database_url (str): SQLAlchemy database URL.
+
+    Returns:
+    sqlalchemy.engine.Engine: The engine for the database.
+    """
+    with _engines_lock:
+        if database_url not in _engines:
+            _engines[database_url] = _create_engine(database_url)
+        return _engines[database_url]
+
+def create_dynamic_table(fields, table_name, db_engine=None, upsert=False, dedupe_key=DEDUPE_KEY):
     """
     Create a new table with the given fields if it doesn't already exist.
 
     Parameters:
     fields (dict): Dictionary of field names and SQLAlchemy field types.
     table_name (str): The name of the table to be created.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    upsert (bool): Give the table the content hash column used by save_results' upsert mode.
+    dedupe_key (tuple): Columns identifying a record, enforced by a unique index.
 
     Returns:
     sqlalchemy.Table: The created or existing table.
     """
+    db_engine = db_engine or engine
+    # Each table gets its own MetaData so tables of other resources and databases are never created here
+    table_metadata = MetaData()
      
     # Check if the table already exists
-    if not inspect(engine).has_table(table_name):
+    if not inspect(db_engine).has_table(table_name):
         # Create the columns for the new table
         columns = [Column('id', Integer, primary_key=True, index=True)]
         for field_name, field_type in fields.items():
             columns.append(Column(field_name, field_type))
+        if upsert:
+            columns.append(Column(HASH_COLUMN, String(2 * HASH_SIZE)))
         
         # Define the table with the metadata
-        dynamic_table = Table(table_name, metadata, *columns)
-        metadata.create_all(engine)  # Create the table in the database
+        dynamic_table = Table(table_name, table_metadata, *columns)
+        _check_dedupe_key(dynamic_table, dedupe_key)
+        _dedupe_index(dynamic_table, dedupe_key)
+        dynamic_table.create(db_engine)  # Create the table in the database
     else:
         # Load the existing table
-        dynamic_table = Table(table_name, metadata, autoload_with=engine)
+        dynamic_table = Table(table_name, table_metadata, autoload_with=db_engine)
         logging.info(f"Table {table_name} already exists, loaded existing table schema.")
+        _check_dedupe_key(dynamic_table, dedupe_key)
+        add_dedupe_index(dynamic_table, db_engine, dedupe_key)
+        if upsert and HASH_COLUMN not in dynamic_table.c:
+            _add_hash_column(dynamic_table, db_engine)
 
     return dynamic_table
+
+def _add_hash_column(table, db_engine):
+    # Existing rows keep a NULL hash, so their first upsert rewrites them once
+    column = Column(HASH_COLUMN, String(2 * HASH_SIZE))
+    preparer = db_engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=db_engine.dialect)
+    with db_engine.begin() as connection:
+        connection.execute(text(
+            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(HASH_COLUMN)} {column_type}"
+        ))
+    table.append_column(column)
+    logging.info(f"Added column {HASH_COLUMN} to table {table.name}")
+
+def _check_dedupe_key(table, key):
+    missing = [name for name in key if name not in table.c]
+    if missing:
+        raise ValueError(f"Dedupe key column(s) {', '.join(missing)} not in table {table.name}")
+
+def _dedupe_index(table, key=DEDUPE_KEY):
+    return Index(f"uq_{table.name}_{'_'.join(key)}", *(table.c[name] for name in key), unique=True)
+
+def _is_dedupe_index(index, table):
+    return index.unique and index.name is not None and index.name.startswith(f"uq_{table.name}_")
+
+def has_dedupe_index(table, key=DEDUPE_KEY):
+    """
+    Check whether the table has a unique index on the dedupe key.
+
+    Parameters:
+    table (sqlalchemy.Table): The table to check.
+    key (tuple): The dedupe key columns.
+
+    Returns:
+    bool: True if duplicates of the key are rejected by the database.
+    """
+    return any(index.unique and tuple(column.name for column in index.columns) == tuple(key)
+               for index in table.indexes)
+
+def add_dedupe_index(table, db_engine=None, key=DEDUPE_KEY):
+    """
+    Add the unique dedupe key index to a table created without it.
+
+    The index cannot be created while the table holds duplicate keys; that is
+    logged and save_results then falls back to looking keys up before inserting.
+    Once it exists, dedupe indexes on a previously configured key are dropped,
+    as they would reject rows the new key accepts (e.g. a reassigned _id).
+
+    Parameters:
+    table (sqlalchemy.Table): The existing table.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    key (tuple): The dedupe key columns.
+    """
+    db_engine = db_engine or engine
+    if not all(name in table.c for name in key):
+        return
+    if not has_dedupe_index(table, key):
+        index = _dedupe_index(table, key)
+        try:
+            index.create(db_engine)
+            logging.info(f"Added unique index {index.name} to table {table.name}")
+        except Exception as e:
+            table.indexes.discard(index)
+            logging.error(f"Could not add unique index {index.name} to table {table.name}: {e}")
+            return
+    for index in list(table.indexes):
+        if _is_dedupe_index(index, table) and tuple(column.name for column in index.columns) != tuple(key):
+            index.drop(db_engine)
+            table.indexes.discard(index)
+            logging.info(f"Dropped unique index {index.name} of a previous dedupe key from table {table.name}")
     
-def convert_dates(record):
+def compile_row_converter(table):
+    """
+    Compile the conversion of records into rows for the given table.
+
+    The table's column types are inspected once into a plan of the coerced
+    columns (ISO strings to datetimes for DateTime columns, integers to
+    floats for Float columns). Every other value is copied as is, so no value
+    is sniffed per row.
+
+    Parameters:
+    table (sqlalchemy.Table): The created or reflected table.
+
+    Returns:
+    function: Takes a record and returns a new, converted row dict.
+    """
+    # (column type, input type the coercion applies to, coercion); parse_datetime memoises repeated values
+    coercions = ((DateTime, str, lambda value: parse_datetime(value) or value), (Float, int, float))
+    plan = {}
+    for column in table.columns:
+        for column_type, input_type, coerce in coercions:
+            if isinstance(column.type, column_type):
+                plan[column.name] = (input_type, coerce)
+                break
+
+    def convert(record):
+        row = dict(record)
+        for name, (input_type, coerce) in plan.items():
+            value = row.get(name)
+            if value.__class__ is input_type:
+                row[name] = coerce(value)
+        return row
+
+    return convert
+
+def convert_rows(records, table, converter=None):
+    """
+    Convert a batch of records into rows for the given table.
+
+    Parameters:
+    records (iterable): The records to convert; they are not modified.
+    table (sqlalchemy.Table): The table the rows are for.
+    converter (function): A converter from compile_row_converter, compiled if not given.
+
+    Returns:
+    list: The converted rows.
+    """
+    converter = converter or compile_row_converter(table)
+    return [converter(record) for record in records]
+
+def compile_row_hasher(table):
+    """
+    Compile the content hash of records stored in the given table.
+
+    The hash covers the record's values for the table's data columns, in
+    column order, and leaves out the surrogate id, the CKAN _id row number and
+    the hash column itself.
+
+    Parameters:
+    table (sqlalchemy.Table): The table the records are stored in.
+
+    Returns:
+    function: Takes a record and returns its hex digest.
+    """
+    names = tuple(column.name for column in table.columns if column.name not in ('id', '_id', HASH_COLUMN))
+    blake2b = hashlib.blake2b
+
+    def content_hash(record):
+        get = record.get
+        return blake2b(repr([get(name) for name in names]).encode(), digest_size=HASH_SIZE).hexdigest()
+
+    return content_hash
+
+# counts_skipped: the insert skips duplicates and its executemany row count reports the rows inserted
+_Statements = namedtuple('_Statements', ['insert', 'ignores_duplicates', 'counts_skipped', 'upsert', 'update'])
+
+def _key_of(row, key):
+    return tuple(row.get(name) for name in key)
+
+def _ignore_duplicates(table, dialect, key):
+    # Dialect-native insert that skips rows conflicting with the dedupe key
+    if dialect.name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=list(key))
+    if dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=list(key))
+    if dialect.name in ('mysql', 'mariadb'):
+        return table.insert().prefix_with('IGNORE')
+    return None
+
+def _native_upsert(table, dialect, key):
+    # Dialect-native insert that updates rows conflicting with the dedupe key
+    names = [column.name for column in table.columns if column.name != 'id' and column.name not in key]
+    if dialect.name in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialect.name == 'sqlite' else postgresql).insert(table)
+        return insert.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: insert.excluded[name] for name in names},
+            where=table.c[HASH_COLUMN].is_distinct_from(insert.excluded[HASH_COLUMN]),
+        )
+    if dialect.name in ('mysql', 'mariadb'):
+        insert = mysql.insert(table)
+        return insert.on_duplicate_key_update({name: insert.inserted[name] for name in names})
+    return None
+
+def _statements(table, dialect, key, upsert):
+    indexed = has_dedupe_index(table, key)
+    insert = _ignore_duplicates(table, dialect, key) if indexed else None
+    native_upsert = _native_upsert(table, dialect, key) if upsert and indexed else None
+    update = None
+    if upsert and native_upsert is None:
+        condition = [table.c[name] == bindparam(f'_key_{name}') for name in key]
+        update = table.update().where(*condition)
+    # Without a reliable executemany row count (e.g. psycopg2), skipped rows are counted by a lookup
+    # before the insert, which still skips rows stored concurrently by other writers
+    counts_skipped = insert is not None and dialect.supports_sane_multi_rowcount
+    return _Statements(insert if insert is not None else table.insert(), insert is not None, counts_skipped,
+                       native_upsert, update)
+
+def _stored(connection, table, rows, key, *columns):
+    # One lookup per batch: the stored values of the given columns by dedupe key
+    key_columns = [table.c[name] for name in key]
+    keys = list({_key_of(row, key) for row in rows})
+    if len(key) == 1:
+        condition = key_columns[0].in_([value for value, in keys])
+    else:
+        condition = tuple_(*key_columns).in_(keys)
+    query = select(*key_columns, *(table.c[name] for name in columns)).where(condition)
+    return {tuple(row[:len(key)]): tuple(row[len(key):]) for row in connection.execute(query)}
+
+def _plan_batch(connection, table, rows, key, statements, upsert):
+    # Split a batch into rows to insert and rows to update, dropping keys repeated within it.
+    # Stored keys are only looked up when the database cannot skip and count duplicates or hashes need comparing.
+    if statements.counts_skipped and not upsert:
+        return rows, []
+    stored = _stored(connection, table, rows, key, *([HASH_COLUMN] if upsert else []))
+    seen = set()
+    inserts, updates = [], []
+    for row in rows:
+        row_key = _key_of(row, key)
+        if row_key in seen:
+            continue
+        seen.add(row_key)
+        if row_key not in stored:
+            inserts.append(row)
+        elif upsert and stored[row_key][0] != row[HASH_COLUMN]:
+            updates.append(row)
+    return inserts, updates
+
+def _write_rows(connection, statements, key, inserts, updates):
+    # One executemany per statement; returns the inserted and updated counts
+    if statements.upsert is not None:
+        connection.execute(statements.upsert, inserts + updates)
+        return len(inserts), len(updates)
+    inserted = 0
+    if inserts:
+        result = connection.execute(statements.insert, inserts)
+        inserted = result.rowcount if statements.counts_skipped else len(inserts)
+    if updates:
+        connection.execute(statements.update, [
+            dict(row, **{f'_key_{name}': row[name] for name in key}) for row in updates
+        ])
+    return inserted, len(updates)
+
+def _write_one_by_one(connection, statements, key, inserts, updates):
+    # Fallback for a failed batch: isolate the rows causing the error
+    inserted = updated = failed = 0
+    for row, is_update in [(row, False) for row in inserts] + [(row, True) for row in updates]:
+        try:
+            with connection.begin_nested():
+                counts = _write_rows(connection, statements, key, [] if is_update else [row], [row] if is_update else [])
+            inserted += counts[0]
+            updated += counts[1]
+        except Exception as e:
+            failed += 1
+            logging.error(f"Error inserting record {row}: {e}")
+    return inserted, updated, failed
+
+def compile_row_preparer(table, upsert=False):
     """
-    Convert string dates in the record to datetime objects.
+    Compile the conversion of records into the rows save_rows writes.
 
     Parameters:
-    record (dict): The record containing data to be inserted.
+    table (sqlalchemy.Table): The created or reflected table.
+    upsert (bool): Also store each record's content hash, for save_rows' upsert mode.
 
     Returns:
-    dict: The record with dates converted to datetime objects.
+    function: Takes a record and returns a new row dict.
     """
-    for key, value in record.items():
-        if isinstance(value, str) and is_datetime(value):
-            try:
-                record[key] = datetime.datetime.fromisoformat(value)
-            except ValueError as e:
-                logging.error(f"Error converting date for field {key} in record {record}: {e}")
-                raise
-    return record
+    convert = compile_row_converter(table)
+    if not upsert:
+        return convert
+    content_hash = compile_row_hasher(table)
+
+    def prepare(record):
+        row = convert(record)
+        row[HASH_COLUMN] = content_hash(record)
+        return row
+
+    return prepare
+
+def _save_batch(connection, table, batch, key, statements, upsert):
+    # Returns the inserted, updated and failed counts of one batch
+    inserts, updates = _plan_batch(connection, table, batch, key, statements, upsert)
+    if not inserts and not updates:
+        return 0, 0, 0
+    try:
+        with connection.begin_nested():
+            inserted, updated = _write_rows(connection, statements, key, inserts, updates)
+        return inserted, updated, 0
+    except Exception as e:
+        logging.error(f"Error inserting batch into {table.name}, retrying record by record: {e}")
+        return _write_one_by_one(connection, statements, key, inserts, updates)
+
+def save_rows(rows, table, db_engine=None, batch_size=BATCH_SIZE, upsert=False, dedupe_key=DEDUPE_KEY,
+              checkpoint=None):
+    """
+    Save rows prepared by compile_row_preparer to the specified table, in one transaction unless checkpointed.
+
+    Rows are written in batches, each with a single executemany of one
+    compiled INSERT, and only one batch is held at a time. Duplicates of the
+    dedupe key are skipped by the database itself (ON CONFLICT DO NOTHING /
+    INSERT IGNORE) and counted from the statement's row count. If a batch
+    fails, its rows are retried one by one so only the offending records are
+    dropped.
+
+    In upsert mode the stored content hashes of a batch are fetched in one
+    query and only new rows and rows whose hash changed are written, with
+    ON CONFLICT DO UPDATE (ON DUPLICATE KEY UPDATE on MySQL) where the dialect
+    supports it and an UPDATE by key otherwise.
+
+    With a checkpoint function, every batch is committed in its own
+    transaction together with what the function writes (see
+    write_checkpoint), so an interrupted save keeps its committed batches and
+    knows where to resume.
+
+    Parameters:
+    rows (iterable): Prepared rows to be inserted.
+    table (sqlalchemy.Table): The table to insert rows into.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    batch_size (int): Number of rows per INSERT batch.
+    upsert (bool): Update stored rows whose content changed; the table needs the hash column.
+    dedupe_key (tuple): Columns identifying a record, as given to create_dynamic_table.
+    checkpoint (function): Called with the connection and each written batch, before the batch is committed.
+
+    Returns:
+    SaveCounts: The number of rows inserted, updated and skipped as duplicates or unchanged.
+    """
+    db_engine = db_engine or engine
+    key = tuple(dedupe_key)
+    statements = _statements(table, db_engine.dialect, key, upsert)
+    total = inserted = updated = failed = 0
+    if checkpoint is None:
+        with db_engine.begin() as connection:
+            for batch in batched(rows, batch_size):
+                total += len(batch)
+                counts = _save_batch(connection, table, batch, key, statements, upsert)
+                inserted, updated, failed = inserted + counts[0], updated + counts[1], failed + counts[2]
+    else:
+        for batch in batched(rows, batch_size):
+            with db_engine.begin() as connection:
+                counts = _save_batch(connection, table, batch, key, statements, upsert)
+                checkpoint(connection, batch)
+            total += len(batch)
+            inserted, updated, failed = inserted + counts[0], updated + counts[1], failed + counts[2]
+    skipped = total - inserted - updated - failed
+    logging.info(f"Committed {inserted} new and {updated} updated records to table {table.name}, skipped {skipped}")
+    return SaveCounts(inserted, updated, skipped)
 
-def save_results(records, table):
+def save_results(records, table, db_engine=None, batch_size=BATCH_SIZE, upsert=False, dedupe_key=DEDUPE_KEY,
+                 checkpoint=None):
     """
-    Save the given records to the specified table.
+    Convert the given records and save them to the specified table, see save_rows.
 
     Parameters:
-    records (list): List of records to be inserted.
+    records (iterable): Records to be inserted; they are not modified.
     table (sqlalchemy.Table): The table to insert records into.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    batch_size (int): Number of records per INSERT batch.
+    upsert (bool): Update stored records whose content changed; the table needs the hash column.
+    dedupe_key (tuple): Columns identifying a record, as given to create_dynamic_table.
+    checkpoint (function): Commit every batch on its own with what this writes, see save_rows.
+
+    Returns:
+    SaveCounts: The number of records inserted, updated and skipped as duplicates or unchanged.
+    """
+    prepare = compile_row_preparer(table, upsert)
+    return save_rows(map(prepare, records), table, db_engine, batch_size, upsert, dedupe_key, checkpoint)
+
+def get_high_watermark(resource_id=RESOURCE_ID, db_engine=None):
+    """
+    Get the highest _id ingested so far for a resource.
+
+    Parameters:
+    resource_id (str): The resource to look up.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+
+    Returns:
+    int: The stored high-watermark, or 0 if the resource was never synced.
+    """
+    db_engine = db_engine or engine
+    sync_state.create(db_engine, checkfirst=True)
+    with db_engine.connect() as connection:
+        query = select(sync_state.c.high_watermark).where(sync_state.c.resource_id == resource_id)
+        return connection.execute(query).scalar() or 0
+
+def set_high_watermark(high_watermark, resource_id=RESOURCE_ID, db_engine=None):
+    """
+    Store the highest _id ingested for a resource.
+
+    Parameters:
+    high_watermark (int): The new high-watermark.
+    resource_id (str): The resource it belongs to.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    """
+    db_engine = db_engine or engine
+    sync_state.create(db_engine, checkfirst=True)
+    with db_engine.begin() as connection:
+        write_high_watermark(connection, high_watermark, resource_id)
+    logging.info(f"High-watermark for resource {resource_id} set to {high_watermark}")
+
+def write_high_watermark(connection, high_watermark, resource_id=RESOURCE_ID):
+    """
+    Store the highest _id ingested for a resource within the caller's transaction.
+
+    The sync_state table must exist, see get_high_watermark.
+
+    Parameters:
+    connection (sqlalchemy.engine.Connection): The connection of an open transaction.
+    high_watermark (int): The new high-watermark.
+    resource_id (str): The resource it belongs to.
+    """
+    values = {'high_watermark': high_watermark, 'updated_at': datetime.datetime.now()}
+    updated = connection.execute(
+        sync_state.update().where(sync_state.c.resource_id == resource_id).values(**values)
+    ).rowcount
+    if not updated:
+        connection.execute(sync_state.insert().values(resource_id=resource_id, **values))
+
+def get_checkpoint(run_id, db_engine=None):
+    """
+    Get the checkpoint of an ingest run.
+
+    Parameters:
+    run_id (str): Identifies the run, e.g. one backfill shard of a resource.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+
+    Returns:
+    Checkpoint: The last committed progress of the run, or None if it never committed a batch.
+    """
+    db_engine = db_engine or engine
+    ingest_checkpoints.create(db_engine, checkfirst=True)
+    with db_engine.connect() as connection:
+        row = connection.execute(
+            select(ingest_checkpoints.c.cursor, ingest_checkpoints.c.last_key, ingest_checkpoints.c.status)
+            .where(ingest_checkpoints.c.run_id == run_id)
+        ).first()
+    return Checkpoint(*row) if row is not None else None
+
+def latest_checkpoint(prefix, db_engine=None, since=None):
+    """
+    Find the most recently updated unfinished run whose id starts with prefix.
+
+    Parameters:
+    prefix (str): Start of the run ids to consider.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    since (datetime.datetime): Ignore runs whose checkpoint was last written before this.
+
+    Returns:
+    tuple: (run id, Checkpoint) of the run, or None if there is none.
+    """
+    db_engine = db_engine or engine
+    ingest_checkpoints.create(db_engine, checkfirst=True)
+    query = (select(ingest_checkpoints.c.run_id, ingest_checkpoints.c.cursor, ingest_checkpoints.c.last_key,
+                    ingest_checkpoints.c.status)
+             .where(ingest_checkpoints.c.run_id.startswith(prefix, autoescape=True),
+                    ingest_checkpoints.c.status == RUNNING)
+             .order_by(ingest_checkpoints.c.updated_at.desc()).limit(1))
+    if since is not None:
+        query = query.where(ingest_checkpoints.c.updated_at >= since)
+    with db_engine.connect() as connection:
+        row = connection.execute(query).first()
+    return (row[0], Checkpoint(*row[1:])) if row is not None else None
+
+def prune_checkpoints(prefix, keep, db_engine=None):
+    """
+    Delete the checkpoints of the runs whose id starts with prefix, except one.
+
+    Parameters:
+    prefix (str): Start of the run ids to delete.
+    keep (str): The run id to keep, usually the run that just finished.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
+    """
+    db_engine = db_engine or engine
+    with db_engine.begin() as connection:
+        connection.execute(ingest_checkpoints.delete().where(
+            ingest_checkpoints.c.run_id.startswith(prefix, autoescape=True), ingest_checkpoints.c.run_id != keep))
+
+def _upsert_checkpoint(connection, run_id, resource_id, **values):
+    values['updated_at'] = datetime.datetime.now()
+    updated = connection.execute(
+        ingest_checkpoints.update().where(ingest_checkpoints.c.run_id == run_id).values(**values)
+    ).rowcount
+    if not updated:
+        connection.execute(ingest_checkpoints.insert().values(run_id=run_id, resource_id=resource_id, **values))
+
+def write_checkpoint(connection, run_id, resource_id, cursor, last_key=None):
+    """
+    Record the progress of a running ingest within the transaction of its batch.
+
+    The ingest_checkpoints table must exist, see get_checkpoint.
+
+    Parameters:
+    connection (sqlalchemy.engine.Connection): The connection of an open transaction.
+    run_id (str): Identifies the run.
+    resource_id (str): The resource the run ingests.
+    cursor (int): The highest _id committed by the run; a resumed run fetches the records above it.
+    last_key (str): The dedupe key of the last committed row, as JSON.
+    """
+    _upsert_checkpoint(connection, run_id, resource_id, cursor=cursor, last_key=last_key, status=RUNNING)
+
+def finish_checkpoint(run_id, resource_id, cursor, db_engine=None):
+    """
+    Mark an ingest run as done, so it is not resumed.
+
+    Parameters:
+    run_id (str): Identifies the run.
+    resource_id (str): The resource the run ingests.
+    cursor (int): The highest _id the run committed.
+    db_engine (sqlalchemy.engine.Engine): The database to use, defaults to the [database] engine.
     """
-    db = SessionLocal()
-    for record in records:
-        # Check if the record already exists to avoid duplication
-        if not db.query(table).filter_by(_id=record['_id']).first():
-            try:
-                record = convert_dates(record)  # Convert date strings to datetime objects
-                ins = table.insert().values(**record)
-                db.execute(ins)  # Execute the insert statement
-                logging.info(f"Inserted record {record}")
-            except Exception as e:
-                logging.error(f"Error inserting record {record}: {e}")
-                logging.error(f"Record causing error: {record}")
-    db.commit()
-    logging.info(f"Committed all records to table {table.name}")
-    db.close()
\ No newline at end of file
+    db_engine = db_engine or engine
+    ingest_checkpoints.create(db_engine, checkfirst=True)
+    with db_engine.begin() as connection:
+        _upsert_checkpoint(connection, run_id, resource_id, cursor=cursor, status=DONE)
@@ -0,0 +1,275 @@
+from collections import namedtuple
+from sqlalchemy import MetaData, Table, Column, Integer, String, Date, DateTime, select, update, and_, or_, func
+from sqlalchemy.exc import IntegrityError
+import configparser
+import datetime
+import logging
+import os
+import socket
+import threading
+
+# Load configuration
+config = configparser.ConfigParser()
+config.read('config.ini')
+LEASE_SECONDS = config['database'].getint('lease_seconds', fallback=300)
+MAX_ATTEMPTS = config['database'].getint('max_attempts', fallback=3)
+
+# Claimable jobs read per claim attempt; the first one not taken by another worker is claimed
+CLAIM_CANDIDATES = 10
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+metadata = MetaData()
+
+# Work shared by ingest hosts: one row per resource and delivery date shard
+ingest_jobs = Table(
+    'ingest_jobs', metadata,
+    Column('resource', String, primary_key=True),
+    Column('shard_start', Date, primary_key=True),
+    Column('shard_end', Date, primary_key=True),
+    Column('status', String, nullable=False),
+    Column('lease_owner', String),
+    Column('lease_expires', DateTime),
+    Column('attempts', Integer, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+Job = namedtuple('Job', ['resource', 'shard_start', 'shard_end', 'attempts'])
+
+def _now():
+    # Lease times are compared across hosts, so they are kept in UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _is_job(job):
+    return and_(ingest_jobs.c.resource == job.resource, ingest_jobs.c.shard_start == job.shard_start,
+                ingest_jobs.c.shard_end == job.shard_end)
+
+def sync_job_name(resource):
+    """
+    Name of the job table entries leasing the daily sync of a resource.
+
+    Sync leases are kept apart from the backfill shards of the resource, so
+    a backfill never claims them.
+
+    Parameters:
+    resource (str): Name of the resource (its [resource:<name>] section).
+
+    Returns:
+    str: The name sync jobs are stored under.
+    """
+    return f"sync:{resource}"
+
+def _within(query, within):
+    # Only jobs whose shard lies within the (first day, last day) range
+    if within is None:
+        return query
+    return query.where(ingest_jobs.c.shard_start >= within[0], ingest_jobs.c.shard_end <= within[1])
+
+def worker_id():
+    """
+    Identify this process as a lease owner.
+
+    Returns:
+    str: host name and process id.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue_jobs(db_engine, resource, shards):
+    """
+    Add the shards of a resource to the job table, skipping the ones already there.
+
+    Parameters:
+    db_engine (sqlalchemy.engine.Engine): The database holding the job table.
+    resource (str): Name of the resource (its [resource:<name>] section).
+    shards (iterable): (first day, last day) of each shard.
+
+    Returns:
+    int: The number of jobs added.
+    """
+    ingest_jobs.create(db_engine, checkfirst=True)
+    added = 0
+    with db_engine.begin() as connection:
+        for shard_start, shard_end in shards:
+            try:
+                with connection.begin_nested():
+                    connection.execute(ingest_jobs.insert().values(
+                        resource=resource, shard_start=shard_start, shard_end=shard_end, status=PENDING,
+                        attempts=0, updated_at=_now()))
+                added += 1
+            except IntegrityError:
+                # Enqueued by another worker
+                continue
+    return added
+
+def claim_job(db_engine, owner, resources=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+              within=None):
+    """
+    Atomically claim a pending job, or a running one whose lease expired.
+
+    Each candidate is claimed with a conditional UPDATE that only matches
+    while the job is still claimable and its attempt count unchanged, so two
+    workers can never claim the same job. Expired jobs that used up their
+    attempts are marked failed instead.
+
+    Parameters:
+    db_engine (sqlalchemy.engine.Engine): The database holding the job table.
+    owner (str): The claiming worker, see worker_id.
+    resources (iterable): Only claim jobs of these resources, None for all.
+    lease_seconds (int): How long the claim holds without being renewed.
+    max_attempts (int): Jobs are not claimed again once attempted this often.
+    within (tuple): Only claim jobs whose shard lies within this (first day, last day) range.
+
+    Returns:
+    Job: The claimed job, or None if no job is claimable.
+    """
+    ingest_jobs.create(db_engine, checkfirst=True)
+    now = _now()
+    expired = and_(ingest_jobs.c.status == RUNNING, ingest_jobs.c.lease_expires < now)
+    claimable = or_(ingest_jobs.c.status == PENDING, expired)
+    with db_engine.begin() as connection:
+        connection.execute(update(ingest_jobs).where(expired, ingest_jobs.c.attempts >= max_attempts)
+                           .values(status=FAILED, lease_owner=None, updated_at=now))
+
+    query = select(ingest_jobs.c.resource, ingest_jobs.c.shard_start, ingest_jobs.c.shard_end,
+                   ingest_jobs.c.attempts).where(claimable, ingest_jobs.c.attempts < max_attempts)
+    if resources is not None:
+        query = query.where(ingest_jobs.c.resource.in_(list(resources)))
+    query = _within(query, within).order_by(ingest_jobs.c.shard_start, ingest_jobs.c.resource).limit(CLAIM_CANDIDATES)
+    with db_engine.connect() as connection:
+        candidates = [Job(*row) for row in connection.execute(query)]
+
+    for candidate in candidates:
+        with db_engine.begin() as connection:
+            claimed = connection.execute(
+                update(ingest_jobs)
+                .where(_is_job(candidate), claimable, ingest_jobs.c.attempts == candidate.attempts)
+                .values(status=RUNNING, lease_owner=owner, attempts=candidate.attempts + 1, updated_at=now,
+                        lease_expires=now + datetime.timedelta(seconds=lease_seconds))
+            ).rowcount
+        if claimed:
+            logging.info(f"{owner} claimed job {candidate.resource} {candidate.shard_start}..{candidate.shard_end}")
+            return candidate._replace(attempts=candidate.attempts + 1)
+    return None
+
+def _update_owned(db_engine, job, owner, **values):
+    # Only the lease owner may change a running job
+    with db_engine.begin() as connection:
+        return bool(connection.execute(
+            update(ingest_jobs)
+            .where(_is_job(job), ingest_jobs.c.status == RUNNING, ingest_jobs.c.lease_owner == owner)
+            .values(updated_at=_now(), **values)
+        ).rowcount)
+
+def renew_lease(db_engine, job, owner, lease_seconds=LEASE_SECONDS):
+    """
+    Extend the lease of a claimed job.
+
+    Returns:
+    bool: False if the lease was lost (it expired and another worker claimed the job).
+    """
+    return _update_owned(db_engine, job, owner, lease_expires=_now() + datetime.timedelta(seconds=lease_seconds))
+
+def complete_job(db_engine, job, owner):
+    """
+    Mark a claimed job as done.
+
+    Returns:
+    bool: False if the lease was lost before completion.
+    """
+    return _update_owned(db_engine, job, owner, status=DONE, lease_owner=None, lease_expires=None)
+
+def release_job(db_engine, job, owner, failed=False, max_attempts=MAX_ATTEMPTS):
+    """
+    Give a claimed job back, to be claimed again.
+
+    Parameters:
+    db_engine (sqlalchemy.engine.Engine): The database holding the job table.
+    job (Job): The claimed job.
+    owner (str): The worker holding the lease.
+    failed (bool): The attempt failed; the job is marked failed once it used up max_attempts.
+    max_attempts (int): Attempts allowed per job.
+
+    Returns:
+    bool: False if the lease was already lost.
+    """
+    if failed and job.attempts >= max_attempts:
+        logging.error(f"Job {job.resource} {job.shard_start}..{job.shard_end} failed {job.attempts} times")
+        return _update_owned(db_engine, job, owner, status=FAILED, lease_owner=None, lease_expires=None)
+    values = {} if failed else {'attempts': ingest_jobs.c.attempts - 1}
+    return _update_owned(db_engine, job, owner, status=PENDING, lease_owner=None, lease_expires=None, **values)
+
+def count_unfinished(db_engine, resources=None, within=None):
+    """
+    Count the jobs that are neither done nor failed.
+
+    Parameters:
+    db_engine (sqlalchemy.engine.Engine): The database holding the job table.
+    resources (iterable): Only count jobs of these resources, None for all.
+    within (tuple): Only count jobs whose shard lies within this (first day, last day) range.
+
+    Returns:
+    int: The number of pending and running jobs.
+    """
+    ingest_jobs.create(db_engine, checkfirst=True)
+    query = select(func.count()).select_from(ingest_jobs).where(ingest_jobs.c.status.in_([PENDING, RUNNING]))
+    if resources is not None:
+        query = query.where(ingest_jobs.c.resource.in_(list(resources)))
+    with db_engine.connect() as connection:
+        return connection.execute(_within(query, within)).scalar()
+
+class LeaseRenewer:
+    """
+    Background thread renewing the leases of the jobs a worker holds.
+
+    Leases are renewed every third of lease_seconds. A job whose lease could
+    not be renewed is reported by lost(), so its results are not completed
+    by a worker that no longer owns it.
+    """
+
+    def __init__(self, owner, lease_seconds=LEASE_SECONDS):
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self._held = {}
+        self._lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-renewer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held.items())
+            for job, db_engine in held:
+                try:
+                    renewed = renew_lease(db_engine, job, self.owner, self.lease_seconds)
+                except Exception as e:
+                    logging.warning(f"Could not renew the lease of job {job.resource} {job.shard_start}: {e}")
+                    continue
+                if not renewed:
+                    logging.warning(f"Lost the lease of job {job.resource} {job.shard_start}..{job.shard_end}")
+                    with self._lock:
+                        self._held.pop(job, None)
+                        self._lost.add(job)
+
+    def hold(self, job, db_engine):
+        with self._lock:
+            self._held[job] = db_engine
+
+    def drop(self, job):
+        with self._lock:
+            self._held.pop(job, None)
+
+    def lost(self, job):
+        with self._lock:
+            return job in self._lost
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
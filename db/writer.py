@@ -0,0 +1,82 @@
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+
+# Write jobs waiting for a database's writer thread; submit blocks beyond this
+QUEUE_SIZE = 4
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+class DatabaseWriter:
+    """
+    A single thread executing the writes to one database, in submission order.
+
+    SQLite allows one writer at a time, so the resources ingested
+    concurrently hand their batches to the writer of their database instead
+    of contending for the write lock.
+    """
+
+    def __init__(self, name=None, maxsize=QUEUE_SIZE):
+        self._jobs = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a call to run on the writer thread, blocking while the queue is full.
+
+        Returns:
+        concurrent.futures.Future: The call's result or exception.
+        """
+        future = Future()
+        self._jobs.put((future, fn, args, kwargs))
+        return future
+
+    def close(self):
+        """
+        Run the queued jobs, then stop the writer thread.
+        """
+        self._jobs.put(None)
+        self._thread.join()
+
+def get_writer(database_url):
+    """
+    Get the writer thread of a database, starting it on first use.
+
+    Parameters:
+    database_url (str): SQLAlchemy database URL.
+
+    Returns:
+    DatabaseWriter: The writer for the database.
+    """
+    with _writers_lock:
+        if database_url not in _writers:
+            _writers[database_url] = DatabaseWriter(name=f'writer-{len(_writers)}')
+        return _writers[database_url]
+
+def close_writers():
+    """
+    Stop all writer threads once their queued jobs have run.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+    if writers:
+        logging.info(f"Closed {len(writers)} database writer(s)")
@@ -1,9 +1,21 @@
 import logging
+import argparse
+import signal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import configparser
 
-from api.fetch_data import fetch_auction_results, detect_fields
-from db.dynamic_schema import create_dynamic_table, save_results
+# Only modules that do not load SQLAlchemy are imported here, so a run that
+# finds nothing new upstream finishes without the database stack
+from api.fetch_data import fetch_resource_fingerprint, api_client
+from db.writer import close_writers
+from utils.fingerprints import load_fingerprints, save_fingerprint
+from utils.resources import load_resources
+from utils.run_lock import RunLock
+from utils.schedule import PollSchedule
 
 # Configure logging
 logging.basicConfig(filename='logs.log', level=logging.INFO,
@@ -14,21 +26,216 @@ config = configparser.ConfigParser()
 config.read('config.ini')
 participant_name = config['api'].get('participant_name')
 current_date = datetime.now().date()
+FINGERPRINT_FILE = config['api'].get('fingerprint_file', fallback='sync_fingerprints.json')
+LOCK_FILE = config['api'].get('lock_file', fallback='ingest.lock')
 
-def main():
-    try:
-        results = fetch_auction_results(participant_name)
-        if not results:
-            logging.info("No results fetched.")
+# Outcome of one run: every resource ingested, and whether any resource changed upstream
+RunOutcome = namedtuple('RunOutcome', ['succeeded', 'changed'])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch ESO auction results and save them to the database.")
+    parser.add_argument('--full-resync', action='store_true',
+                        help="ignore the stored high-watermark and fetch the current delivery day's records "
+                             "again, e.g. after the upstream resource was rebuilt; use backfill.py for "
+                             "earlier days")
+    parser.add_argument('--restart', action='store_true',
+                        help="with --full-resync, start from scratch instead of resuming an interrupted resync")
+    parser.add_argument('--distributed', action='store_true',
+                        help="lease each resource's sync through the ingest_jobs table, so only one of "
+                             "several hosts running main.py ingests it")
+    parser.add_argument('--if-running', choices=['exit', 'wait'], default='exit',
+                        help="when another run holds the lock: exit at once, or wait for it and only "
+                             "run if it did not succeed")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and poll on the [daemon] schedule, with warm connections")
+    return parser.parse_args(argv)
+
+def fingerprint_key(resource):
+    # Per section, like the high-watermark: sections sharing a resource and table fetch different participants
+    return f"{resource.sync_key}@{resource.database_url}"
+
+def upstream_fingerprint(resource):
+    """
+    Fingerprint of what an ingest of the resource would fetch today.
+
+    It combines the resource's last upstream modification with the delivery
+    day, since a new day selects new rows even when the resource is unchanged.
+
+    Returns:
+    str: The fingerprint, or None if the upstream modification time is unknown.
+    """
+    last_modified = fetch_resource_fingerprint(resource.resource_id)
+    if last_modified is None:
+        return None
+    return f"{last_modified}|{datetime.now().date().isoformat()}"
+
+def ingest_leased(resource, full_resync=False, restart=False):
+    """
+    Ingest a resource under the lease of its job for the current delivery day.
+
+    The job is given back to pending afterwards, so the next run (on any host)
+    can claim it again; a host that crashes mid-sync holds it until the lease
+    expires.
+
+    Returns:
+    bool: False if another host holds the lease and the resource was skipped.
+    """
+    from db import jobs
+    from db.dynamic_schema import get_engine
+    from pipeline import ingest_resource
+
+    db_engine = get_engine(resource.database_url)
+    today = datetime.now().date()
+    name = jobs.sync_job_name(resource.name)
+    jobs.enqueue_jobs(db_engine, name, [(today, today)])
+    owner = jobs.worker_id()
+    job = jobs.claim_job(db_engine, owner, [name], within=(today, today))
+    if job is None:
+        logging.info(f"Resource {resource.name} is being synced by another worker, skipping.")
+        return False
+    with jobs.LeaseRenewer(owner) as renewer:
+        renewer.hold(job, db_engine)
+        try:
+            ingest_resource(resource, full_resync, restart)
+        finally:
+            renewer.drop(job)
+            jobs.release_job(db_engine, job, owner)
+    return True
+
+def ingest(resource, fingerprint, full_resync=False, distributed=False, restart=False):
+    # Deferred import: loads SQLAlchemy and the database engine
+    from pipeline import ingest_resource
+
+    if distributed:
+        if not ingest_leased(resource, full_resync, restart):
             return
-        
-        fields = detect_fields(results)
-        auction_results_table = create_dynamic_table(fields)
-        save_results(results, auction_results_table)
-        
+    else:
+        ingest_resource(resource, full_resync, restart)
+    if fingerprint is not None:
+        save_fingerprint(FINGERPRINT_FILE, fingerprint_key(resource), fingerprint)
+
+def run(full_resync=False, distributed=False, restart=False):
+    """
+    Ingest every configured resource that changed upstream.
+
+    Returns:
+    RunOutcome: Whether every resource was ingested (or skipped as unchanged), and whether any had changed.
+    """
+    try:
+        resources = load_resources(config)
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         print(f"An error occurred: {e}")
+        return RunOutcome(False, False)
+
+    # Fast path: skip resources whose upstream fingerprint matches the last ingest
+    stored = load_fingerprints(FINGERPRINT_FILE)
+    pending = []
+    for resource in resources:
+        fingerprint = upstream_fingerprint(resource)
+        if not full_resync and fingerprint is not None and stored.get(fingerprint_key(resource)) == fingerprint:
+            logging.info(f"Resource {resource.name} unchanged upstream, skipping.")
+            continue
+        pending.append((resource, fingerprint))
+    if not pending:
+        return RunOutcome(True, False)
+
+    # Resources are ingested concurrently; a failure in one does not affect the others
+    succeeded = True
+    with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+        futures = {
+            executor.submit(ingest, resource, fingerprint, full_resync, distributed, restart): resource
+            for resource, fingerprint in pending
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"An error occurred while ingesting resource {futures[future].name}: {e}")
+                print(f"An error occurred while ingesting resource {futures[future].name}: {e}")
+                succeeded = False
+    close_writers()
+
+    if api_client.cache is not None:
+        logging.info(f"Response cache: {api_client.cache.stats()}")
+    return RunOutcome(succeeded, True)
+
+def main(full_resync=False, distributed=False, if_running='exit', restart=False):
+    """
+    Run the ingest unless another run on this host holds the lock file.
+
+    With if_running='wait', the run waits for the lock and is skipped if the
+    run it waited for succeeded, since that run already fetched what this one
+    would have.
+
+    Returns:
+    RunOutcome: The outcome of the run, or None if it was skipped.
+    """
+    lock = RunLock(LOCK_FILE)
+    waiting_since = time.time()
+    if not lock.acquire():
+        if if_running != 'wait':
+            logging.info("Another run holds the lock, exiting.")
+            print("Another run is in progress, exiting.")
+            return
+        logging.info("Another run holds the lock, waiting for it.")
+        lock.acquire(wait=True)
+        outcome = lock.outcome()
+        if outcome and outcome.get('succeeded') and outcome.get('finished_at', 0) >= waiting_since:
+            logging.info(f"Run of process {outcome.get('pid')} succeeded while waiting, reusing its outcome.")
+            lock.release()
+            return
+    outcome = RunOutcome(False, False)
+    try:
+        outcome = run(full_resync, distributed, restart)
+    finally:
+        lock.release(outcome.succeeded)
+    return outcome
+
+def daemon(full_resync=False, distributed=False, schedule=None, stop=None, restart=False):
+    """
+    Run the ingest repeatedly until stopped, polling on an adaptive schedule.
+
+    The process stays warm between polls: the API client keeps its
+    keep-alive session, the database engines their connection pools, and
+    the pipeline the tables it reflected. Polls that find nothing new
+    upstream only cost the fingerprint requests.
+
+    Parameters:
+    full_resync (bool): Ignore the stored high-watermark on the first poll.
+    restart (bool): Do not resume an interrupted full resync on the first poll.
+    distributed (bool): Lease each resource's sync, see ingest_leased.
+    schedule (utils.schedule.PollSchedule): When to poll, defaults to the [daemon] section of config.ini.
+    stop (threading.Event): Ends the loop once set, defaults to one set by SIGINT and SIGTERM.
+    """
+    # Loaded once, so polls reuse the database stack
+    import pipeline  # noqa: F401
+
+    schedule = schedule or PollSchedule.from_config(
+        config['daemon'] if config.has_section('daemon') else config[config.default_section])
+    if stop is None:
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+
+    logging.info("Ingest daemon started.")
+    while not stop.is_set():
+        changed = False
+        try:
+            outcome = main(full_resync, distributed, restart=restart)
+            changed = outcome is not None and outcome.changed
+        except Exception as e:
+            logging.error(f"An error occurred during a daemon poll: {e}")
+        full_resync = restart = False
+        delay = schedule.next_delay(changed)
+        logging.info(f"Next poll in {delay:.0f}s.")
+        stop.wait(delay)
+    logging.info("Ingest daemon stopped.")
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.daemon:
+        daemon(full_resync=args.full_resync, distributed=args.distributed, restart=args.restart)
+    else:
+        main(full_resync=args.full_resync, distributed=args.distributed, if_running=args.if_running,
+             restart=args.restart)
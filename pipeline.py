@@ -0,0 +1,201 @@
+from collections import deque
+from concurrent.futures import wait
+from datetime import datetime, timedelta
+from itertools import chain
+import json
+import logging
+
+from api.fetch_data import fetch_auction_results, iter_auction_results, detect_fields, INFERENCE_SAMPLE_SIZE
+from db.dynamic_schema import (create_dynamic_table, compile_row_preparer, save_rows, get_high_watermark,
+                               set_high_watermark, write_high_watermark, latest_checkpoint, write_checkpoint,
+                               finish_checkpoint, prune_checkpoints, get_engine)
+from db.writer import get_writer
+from utils.stages import BackgroundIterator
+from utils.utils import batched, peek
+
+# Pages and row batches each stage may run ahead of the next one
+QUEUE_SIZE = 4
+
+# An interrupted full resync is resumed by the next one if it committed a batch within this time;
+# older checkpoints may predate another upstream rebuild
+RESUME_WITHIN = timedelta(hours=24)
+
+# Tables created or reflected so far, reused by later ingests of a long-running process
+_tables = {}
+
+def iter_pages(resource, after_id, fields, schema, start_date=None, end_date=None, cache=True):
+    """
+    Fetch the new records of one resource page by page, filtered to the delivery days.
+
+    Parameters:
+    resource (utils.resources.Resource): The resource to fetch.
+    after_id (int): Only records with an _id above this are fetched.
+    fields (iterable): Fields to fetch, None for all.
+    schema (dict): Receives the column types declared by the API.
+    start_date (datetime.date): First deliveryEnd day, defaults to the current day.
+    end_date (datetime.date): Last deliveryEnd day, defaults to start_date.
+    cache (bool): Allow the response cache to answer the requests.
+
+    Returns:
+    iterable: Lists of records, in _id order.
+    """
+    if resource.page_size:
+        return iter_auction_results(resource.participant_name, resource.page_size, start_date, end_date, after_id,
+                                    resource_id=resource.resource_id, concurrency=resource.fetch_concurrency,
+                                    raise_errors=True, fields=fields, schema=schema, cache=cache)
+    return iter([fetch_auction_results(resource.participant_name, start_date, end_date, after_id,
+                                       resource_id=resource.resource_id, limit=resource.limit, raise_errors=True,
+                                       fields=fields, schema=schema, cache=cache)])
+
+def checkpointer(run_id, resource, after_id, high_watermark=None):
+    """
+    Build the save_rows checkpoint function of an ingest run.
+
+    Records arrive in _id order, so once a batch is committed every record up
+    to its highest _id is stored and a resumed run can fetch from there.
+
+    Parameters:
+    run_id (str): Identifies the run in the ingest_checkpoints table.
+    resource (utils.resources.Resource): The resource the run ingests.
+    after_id (int): The cursor the run started from.
+    high_watermark (str): Also advance the high-watermark stored under this key with each batch.
+
+    Returns:
+    function: Writes the checkpoint of a batch within its transaction.
+    """
+    def checkpoint(connection, batch):
+        cursor = max(after_id, max(row['_id'] for row in batch))
+        last_key = json.dumps([batch[-1][name] for name in resource.dedupe_key], default=str)
+        write_checkpoint(connection, run_id, resource.resource_id, cursor, last_key)
+        if high_watermark is not None:
+            write_high_watermark(connection, cursor, high_watermark)
+    return checkpoint
+
+def watermark_key(resource, day):
+    """
+    Key of the high-watermark of a resource's sync of one delivery day.
+
+    A sync only fetches the records ending on its day, and records of a later
+    day can have lower _ids (the overnight EFA block ends the next day but is
+    published with the current one), so every day keeps its own cursor.
+    """
+    return f"{resource.sync_key}@{day.isoformat()}"
+
+def _run_prefix(resource, full_resync, day=None):
+    # Without a day, the prefix of the runs of every day
+    kind = 'resync' if full_resync else 'sync'
+    if day is None:
+        return f"{kind}:{resource.sync_key}@"
+    return f"{kind}:{watermark_key(resource, day)}:"
+
+def _open_run(resource, day, db_engine, full_resync, restart=False):
+    # Returns the run id and the cursor to fetch from: the day's high-watermark, or where a recently
+    # interrupted full resync of the day stopped. Run ids end with the start of the run.
+    prefix = _run_prefix(resource, full_resync, day)
+    now = datetime.now()
+    run_id = f"{prefix}{now:%Y%m%dT%H%M%S.%f}"
+    high_watermark = get_high_watermark(watermark_key(resource, day), db_engine)
+    interrupted = latest_checkpoint(prefix, db_engine, since=now - RESUME_WITHIN)
+    if not full_resync:
+        # Revisions keep their _id, so upsert mode refetches the whole day to compare the stored hashes
+        return run_id, 0 if resource.upsert else high_watermark
+    if interrupted is not None and not restart:
+        resumed_id, checkpoint = interrupted
+        logging.info(f"Resuming the full resync of resource {resource.name} after _id {checkpoint.cursor}")
+        return resumed_id, checkpoint.cursor
+    return run_id, 0
+
+def _close_run(run_id, resource, cursor, db_engine, full_resync):
+    # Earlier runs, of this day or earlier ones, finished or no longer resumable, are dropped
+    finish_checkpoint(run_id, resource.resource_id, cursor, db_engine)
+    prune_checkpoints(_run_prefix(resource, full_resync), run_id, db_engine)
+
+def _write_batch(batch, table, db_engine, resource, checkpoint, previous):
+    # Runs on the database's writer thread, after the resource's previous batch
+    if previous is not None and previous.exception() is not None:
+        raise RuntimeError(f"Batch of resource {resource.name} skipped after an earlier batch failed")
+    # The high-watermark and checkpoint are committed with the batch
+    save_rows(batch, table, db_engine, resource.batch_size, resource.upsert, resource.dedupe_key, checkpoint)
+
+def ingest_resource(resource, full_resync=False, restart=False):
+    """
+    Fetch the new records of the current delivery day of one resource and save them to its table.
+
+    The stages run concurrently: a fetch thread downloads pages, a converter
+    thread turns records into row batches, and the database's single writer
+    thread commits each batch and then advances the high-watermark. Bounded
+    queues between them keep memory at a few pages and batches, so a run
+    takes about as long as its slowest stage. The table schema is detected
+    from a buffered sample of the head of the stream.
+
+    The first error of any stage is raised once the other stages stopped, so
+    a resource is only reported as ingested when every page was saved.
+
+    Every batch is committed with the run's checkpoint and the day's
+    high-watermark (see watermark_key), so an interrupted run loses at most
+    the batches in flight: the next sync continues from the high-watermark,
+    and a full resync interrupted within RESUME_WITHIN resumes from its
+    checkpoint instead of starting over.
+
+    Parameters:
+    resource (utils.resources.Resource): The resource to ingest.
+    full_resync (bool): Ignore the stored high-watermark and fetch the day's records again.
+    restart (bool): Start a full resync from scratch, even if an interrupted one could be resumed.
+    """
+    db_engine = get_engine(resource.database_url)
+    writer = get_writer(resource.database_url)
+
+    # Incremental sync: only records of the day above its stored high-watermark are requested,
+    # or all of them in upsert mode
+    day = datetime.now().date()
+    run_id, after_id = writer.submit(_open_run, resource, day, db_engine, full_resync, restart).result()
+
+    fields = resource.fetch_fields
+
+    # Filled with the column types the API declares once the first page arrives
+    schema = {}
+    # A sync runs once main.py saw the resource change upstream: a cached page or count from before the
+    # change (entries without validators are served for the cache's whole TTL) would hide the new rows
+    pages = iter_pages(resource, after_id, fields, schema, day, cache=False)
+    with BackgroundIterator(pages, QUEUE_SIZE, name=f'fetch-{resource.name}') as pages:
+        # The table is created from a buffered sample of the head of the stream
+        head, records = peek(chain.from_iterable(pages), INFERENCE_SAMPLE_SIZE)
+        if not head:
+            logging.info(f"No results fetched for resource {resource.name}.")
+            if full_resync and not after_id:
+                writer.submit(set_high_watermark, 0, watermark_key(resource, day), db_engine).result()
+            writer.submit(_close_run, run_id, resource, after_id, db_engine, full_resync).result()
+            return
+        table_key = (db_engine, resource.table_name, resource.upsert, resource.dedupe_key)
+        auction_results_table = _tables.get(table_key)
+        if auction_results_table is None:
+            auction_results_table = writer.submit(create_dynamic_table, detect_fields(head, fields, schema),
+                                                  resource.table_name, db_engine, resource.upsert,
+                                                  resource.dedupe_key).result()
+            _tables[table_key] = auction_results_table
+
+        rows = map(compile_row_preparer(auction_results_table, resource.upsert), records)
+        checkpoint = checkpointer(run_id, resource, after_id, high_watermark=watermark_key(resource, day))
+        cursor = after_id
+        in_flight = deque()
+        try:
+            with BackgroundIterator(batched(rows, resource.batch_size), QUEUE_SIZE,
+                                    name=f'convert-{resource.name}') as batches:
+                for batch in batches:
+                    previous = in_flight[-1] if in_flight else None
+                    in_flight.append(writer.submit(_write_batch, batch, auction_results_table, db_engine,
+                                                   resource, checkpoint, previous))
+                    cursor = max(cursor, max(row['_id'] for row in batch))
+                    # Surface write errors while fetching continues
+                    while len(in_flight) > QUEUE_SIZE or (in_flight and in_flight[0].done()):
+                        in_flight.popleft().result()
+            while in_flight:
+                in_flight.popleft().result()
+            writer.submit(_close_run, run_id, resource, cursor, db_engine, full_resync).result()
+        except Exception:
+            # Reflected again next time, in case the table changed underneath
+            _tables.pop(table_key, None)
+            raise
+        finally:
+            # Queued batches still run (or are skipped after a failure) before returning
+            wait(in_flight)
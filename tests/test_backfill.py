@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import patch
+from sqlalchemy import select
+
+import backfill
+import pipeline
+from db import dynamic_schema
+from utils.resources import Resource
+
+def make_records(start_date, end_date):
+    # Two results per delivery day, with _ids derived from the day
+    records = []
+    day = start_date
+    while day <= end_date:
+        for unit in range(2):
+            records.append({'_id': day.toordinal() * 10 + unit, 'deliveryStart': f'{day}T00:00:00',
+                            'deliveryEnd': f'{day}T04:00:00', 'auctionUnit': f'HAB{unit}-FFR'})
+        day = date.fromordinal(day.toordinal() + 1)
+    return records
+
+def fake_pages(participant_name, page_size, start_date, end_date, *args, **kwargs):
+    return iter([make_records(start_date, end_date)])
+
+class TestDateShards(unittest.TestCase):
+
+    def test_day_shards(self):
+        self.assertEqual(backfill.date_shards(date(2024, 8, 30), date(2024, 9, 1)),
+                         [(date(2024, 8, 30), date(2024, 8, 30)), (date(2024, 8, 31), date(2024, 8, 31)),
+                          (date(2024, 9, 1), date(2024, 9, 1))])
+
+    def test_week_shards_end_with_the_range(self):
+        self.assertEqual(backfill.date_shards(date(2024, 1, 1), date(2024, 1, 10), 'week'),
+                         [(date(2024, 1, 1), date(2024, 1, 7)), (date(2024, 1, 8), date(2024, 1, 10))])
+
+    def test_until_defaults_to_from(self):
+        args = backfill.parse_args(['--from', '2024-08-06'])
+
+        self.assertEqual((args.start, args.end, args.shard), (date(2024, 8, 6), date(2024, 8, 6), 'day'))
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database_url = f"sqlite:///{os.path.join(directory.name, 'results.db')}"
+        self.resource = Resource(name='results_by_unit', resource_id='a63ab354', table_name='results',
+                                 database_url=database_url, participant_name='HABITAT ENERGY LIMITED',
+                                 page_size=100, limit=100, fetch_concurrency=1)
+        self.engine = dynamic_schema.get_engine(database_url)
+
+    def stored_ids(self):
+        table = dynamic_schema.create_dynamic_table({}, 'results', self.engine)
+        with self.engine.connect() as connection:
+            return connection.execute(select(table.c._id).order_by(table.c._id)).scalars().all()
+
+    @patch('pipeline.iter_auction_results', side_effect=fake_pages)
+    def test_every_shard_is_saved_once(self, mock_pages):
+        start, end = date(2024, 8, 1), date(2024, 8, 9)
+
+        failed = backfill.backfill([self.resource], start, end, 'week', workers=2,
+                                   executor=ThreadPoolExecutor(2))
+        # Overlapping second run: already stored records are skipped
+        failed += backfill.backfill([self.resource], date(2024, 8, 9), date(2024, 8, 10), workers=2,
+                                    executor=ThreadPoolExecutor(2))
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.stored_ids(), [record['_id'] for record in make_records(start, date(2024, 8, 10))])
+        self.assertEqual(dynamic_schema.get_high_watermark(pipeline.watermark_key(self.resource, end), self.engine), 0)
+
+    @patch('pipeline.iter_auction_results')
+    def test_failed_shards_are_reported(self, mock_pages):
+        def pages(participant_name, page_size, start_date, end_date, *args, **kwargs):
+            if start_date == date(2024, 8, 2):
+                raise ConnectionError("HTTP 503")
+            return fake_pages(participant_name, page_size, start_date, end_date)
+        mock_pages.side_effect = pages
+
+        failed = backfill.backfill([self.resource], date(2024, 8, 1), date(2024, 8, 3), workers=1,
+                                   executor=ThreadPoolExecutor(1))
+
+        self.assertEqual(failed, [('results_by_unit', date(2024, 8, 2), date(2024, 8, 2))])
+        self.assertEqual(len(self.stored_ids()), 4)
+
+    @patch('pipeline.iter_auction_results', side_effect=fake_pages)
+    def test_rerun_skips_done_shards_and_resumes_interrupted_ones(self, mock_pages):
+        start, end = date(2024, 8, 1), date(2024, 8, 2)
+        backfill.backfill([self.resource], start, start, workers=1, executor=ThreadPoolExecutor(1))
+        # A shard interrupted after committing its first record
+        with self.engine.begin() as connection:
+            dynamic_schema.write_checkpoint(connection, backfill.shard_run_id(self.resource, end, end), 'a63ab354',
+                                            end.toordinal() * 10, None)
+        mock_pages.reset_mock()
+
+        failed = backfill.backfill([self.resource], start, end, workers=1, executor=ThreadPoolExecutor(1))
+
+        self.assertEqual(failed, [])
+        self.assertEqual([(call.args[2], call.args[4]) for call in mock_pages.call_args_list],
+                         [(end, end.toordinal() * 10)])
+        checkpoint = dynamic_schema.get_checkpoint(backfill.shard_run_id(self.resource, end, end), self.engine)
+        self.assertEqual(checkpoint.status, dynamic_schema.DONE)
+
+if __name__ == '__main__':
+    unittest.main()
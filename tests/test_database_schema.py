@@ -1,9 +1,12 @@
 import unittest
-from sqlalchemy import create_engine, MetaData, Table, inspect
+from unittest.mock import patch
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, DateTime, Float, inspect, select
 from sqlalchemy.orm import sessionmaker
 import configparser
 import datetime
 
+from db import dynamic_schema
+
 # Load configuration
 config = configparser.ConfigParser()
 config.read('config.ini')
@@ -57,5 +60,301 @@ class TestDatabase(unittest.TestCase):
             # Check specific business rules
             self.assertGreaterEqual(record.executedQuantity, 0, f"executedQuantity is negative in record {record}")
 
+class TestHighWatermark(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(dynamic_schema, 'engine', create_engine('sqlite://'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unknown_resource_starts_at_zero(self):
+        self.assertEqual(dynamic_schema.get_high_watermark('unknown'), 0)
+
+    def test_watermark_is_stored_per_resource(self):
+        dynamic_schema.set_high_watermark(120, 'resource-a')
+        dynamic_schema.set_high_watermark(7, 'resource-b')
+        dynamic_schema.set_high_watermark(150, 'resource-a')
+
+        self.assertEqual(dynamic_schema.get_high_watermark('resource-a'), 150)
+        self.assertEqual(dynamic_schema.get_high_watermark('resource-b'), 7)
+
+class TestCreateDynamicTable(unittest.TestCase):
+
+    def test_tables_stay_in_their_own_database(self):
+        engine_a = create_engine('sqlite://')
+        engine_b = create_engine('sqlite://')
+
+        dynamic_schema.create_dynamic_table({'_id': Integer}, 'results_a', engine_a)
+        dynamic_schema.create_dynamic_table({'_id': Integer}, 'results_b', engine_b)
+
+        self.assertEqual(inspect(engine_a).get_table_names(), ['results_a'])
+        self.assertEqual(inspect(engine_b).get_table_names(), ['results_b'])
+
+    def test_existing_table_is_reflected(self):
+        engine_a = create_engine('sqlite://')
+        dynamic_schema.create_dynamic_table({'_id': Integer, 'postCode': String}, 'results', engine_a)
+
+        table = dynamic_schema.create_dynamic_table({'_id': Integer}, 'results', engine_a)
+
+        self.assertEqual([c.name for c in table.columns], ['id', '_id', 'postCode'])
+
+class TestSaveResults(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.table = dynamic_schema.create_dynamic_table(
+            {'_id': Integer, 'deliveryStart': DateTime, 'postCode': String}, 'results', self.engine)
+
+    def stored_ids(self):
+        with self.engine.connect() as connection:
+            return connection.execute(select(self.table.c._id).order_by(self.table.c._id)).scalars().all()
+
+    def test_records_are_inserted_in_batches(self):
+        records = [{'_id': i, 'deliveryStart': '2024-08-06T22:00:00', 'postCode': 'TN17'} for i in range(1, 8)]
+
+        counts = dynamic_schema.save_results(iter(records), self.table, self.engine, batch_size=3)
+
+        self.assertEqual(counts, (7, 0, 0))
+        self.assertEqual(self.stored_ids(), list(range(1, 8)))
+
+    def test_stored_and_repeated_ids_are_skipped(self):
+        dynamic_schema.save_results([{'_id': 1}, {'_id': 2}], self.table, self.engine)
+
+        counts = dynamic_schema.save_results([{'_id': 2}, {'_id': 3}, {'_id': 3}], self.table, self.engine)
+
+        self.assertEqual(counts, (1, 0, 2))
+        self.assertEqual(self.stored_ids(), [1, 2, 3])
+
+    def test_duplicates_are_skipped_natively_without_a_multi_row_count(self):
+        # e.g. psycopg2, whose executemany does not report the rows inserted
+        dynamic_schema.save_results([{'_id': 1}, {'_id': 2}], self.table, self.engine)
+
+        with patch.object(self.engine.dialect, 'supports_sane_multi_rowcount', False):
+            statements = dynamic_schema._statements(self.table, self.engine.dialect, ('_id',), False)
+            counts = dynamic_schema.save_results([{'_id': 2}, {'_id': 3}, {'_id': 3}], self.table, self.engine)
+
+        self.assertTrue(statements.ignores_duplicates)
+        self.assertEqual(counts, (1, 0, 2))
+        self.assertEqual(self.stored_ids(), [1, 2, 3])
+
+    def test_failing_record_does_not_drop_its_batch(self):
+        records = [{'_id': 1, 'postCode': 'TN17'}, {'_id': 2, 'postCode': {'not': 'bindable'}}, {'_id': 3, 'postCode': 'TN18'}]
+
+        with self.assertLogs(level='ERROR'):
+            counts = dynamic_schema.save_results(records + [{'_id': 1}], self.table, self.engine)
+
+        self.assertEqual(counts, (2, 0, 1))
+        self.assertEqual(self.stored_ids(), [1, 3])
+
+    def test_new_tables_have_a_unique_dedupe_index(self):
+        indexes = inspect(self.engine).get_indexes('results')
+
+        self.assertIn({'name': 'uq_results__id', 'column_names': ['_id'], 'unique': 1},
+                      [{k: index[k] for k in ('name', 'column_names', 'unique')} for index in indexes])
+
+    def test_index_is_added_to_tables_created_without_it(self):
+        legacy_metadata = MetaData()
+        Table('legacy', legacy_metadata, Column('id', Integer, primary_key=True), Column('_id', Integer))
+        legacy_metadata.create_all(self.engine)
+
+        table = dynamic_schema.create_dynamic_table({}, 'legacy', self.engine)
+
+        self.assertTrue(dynamic_schema.has_dedupe_index(table))
+        self.assertEqual(dynamic_schema.save_results([{'_id': 1}, {'_id': 1}], table, self.engine), (1, 0, 1))
+
+    def test_tables_holding_duplicates_fall_back_to_lookups(self):
+        legacy_metadata = MetaData()
+        legacy = Table('legacy', legacy_metadata, Column('id', Integer, primary_key=True), Column('_id', Integer))
+        legacy_metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(legacy.insert(), [{'_id': 1}, {'_id': 1}])
+
+        with self.assertLogs(level='ERROR'):
+            table = dynamic_schema.create_dynamic_table({}, 'legacy', self.engine)
+
+        self.assertFalse(dynamic_schema.has_dedupe_index(table))
+        self.assertEqual(dynamic_schema.save_results([{'_id': 1}, {'_id': 2}], table, self.engine), (1, 0, 1))
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        # With the pysqlite transaction handling of the module's engines
+        self.engine = dynamic_schema._create_engine('sqlite://')
+        self.table = dynamic_schema.create_dynamic_table({'_id': Integer, 'postCode': String}, 'results', self.engine)
+        self.assertIsNone(dynamic_schema.get_checkpoint('run', self.engine))
+
+    def test_checkpoint_is_committed_with_its_batch(self):
+        def checkpoint(connection, batch):
+            # The batch is not committed before its checkpoint is written
+            self.assertTrue(connection.connection.dbapi_connection.in_transaction)
+            if batch[0]['_id'] == 5:
+                raise ConnectionError("killed")
+            dynamic_schema.write_checkpoint(connection, 'run', 'resource', batch[-1]['_id'], str(batch[-1]['_id']))
+
+        with self.assertRaises(ConnectionError):
+            dynamic_schema.save_results([{'_id': i} for i in range(1, 7)], self.table, self.engine, batch_size=2,
+                                        checkpoint=checkpoint)
+
+        with self.engine.connect() as connection:
+            stored = connection.execute(select(self.table.c._id).order_by(self.table.c._id)).scalars().all()
+        # The batch whose checkpoint failed is rolled back with it
+        self.assertEqual(stored, [1, 2, 3, 4])
+        self.assertEqual(dynamic_schema.get_checkpoint('run', self.engine), (4, '4', dynamic_schema.RUNNING))
+
+    def test_unsaved_rows_are_rolled_back_with_the_transaction(self):
+        with self.assertRaises(ConnectionError):
+            with self.engine.begin() as connection:
+                with connection.begin_nested():
+                    connection.execute(self.table.insert(), [{'_id': 1}])
+                raise ConnectionError("killed")
+
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(select(self.table.c._id)).scalars().all(), [])
+
+    def test_finished_run_keeps_its_last_key(self):
+        with self.engine.begin() as connection:
+            dynamic_schema.write_checkpoint(connection, 'run', 'resource', 10, '[10]')
+
+        dynamic_schema.finish_checkpoint('run', 'resource', 10, self.engine)
+
+        self.assertEqual(dynamic_schema.get_checkpoint('run', self.engine), (10, '[10]', dynamic_schema.DONE))
+
+class TestNaturalKey(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def test_reloaded_resource_is_not_duplicated(self):
+        table = dynamic_schema.create_dynamic_table({'_id': Integer, 'unitResultID': String}, 'results', self.engine,
+                                                    dedupe_key=('unitResultID',))
+        dynamic_schema.save_results([{'_id': 1, 'unitResultID': 'a'}, {'_id': 2, 'unitResultID': 'b'}],
+                                    table, self.engine, dedupe_key=('unitResultID',))
+
+        # Upstream reload: same results, new row numbers, and one new result reusing an old _id
+        counts = dynamic_schema.save_results([{'_id': 7, 'unitResultID': 'a'}, {'_id': 8, 'unitResultID': 'b'},
+                                              {'_id': 1, 'unitResultID': 'c'}],
+                                             table, self.engine, dedupe_key=('unitResultID',))
+
+        self.assertEqual(counts, (1, 0, 2))
+
+    def test_composite_key(self):
+        key = ('auctionUnit', 'deliveryStart')
+        table = dynamic_schema.create_dynamic_table({'_id': Integer, 'auctionUnit': String, 'deliveryStart': DateTime},
+                                                    'results', self.engine, upsert=True, dedupe_key=key)
+        records = [{'_id': 1, 'auctionUnit': 'HAB6-FFR', 'deliveryStart': '2024-08-06T22:00:00'},
+                   {'_id': 2, 'auctionUnit': 'HAB6-FFR', 'deliveryStart': '2024-08-07T02:00:00'}]
+        dynamic_schema.save_results(records, table, self.engine, upsert=True, dedupe_key=key)
+
+        counts = dynamic_schema.save_results(records + [{'_id': 3, 'auctionUnit': 'HAB7-FFR',
+                                                         'deliveryStart': '2024-08-06T22:00:00'}],
+                                             table, self.engine, upsert=True, dedupe_key=key)
+
+        self.assertEqual(counts, (1, 0, 2))
+        self.assertTrue(dynamic_schema.has_dedupe_index(table, key))
+
+    def test_changing_the_key_replaces_the_index(self):
+        dynamic_schema.create_dynamic_table({'_id': Integer, 'unitResultID': String}, 'results', self.engine)
+
+        table = dynamic_schema.create_dynamic_table({}, 'results', self.engine, dedupe_key=('unitResultID',))
+
+        self.assertEqual([index['name'] for index in inspect(self.engine).get_indexes('results')
+                          if index['name'].startswith('uq_')], ['uq_results_unitResultID'])
+        self.assertFalse(dynamic_schema.has_dedupe_index(table))
+
+    def test_key_must_be_a_column(self):
+        with self.assertRaises(ValueError):
+            dynamic_schema.create_dynamic_table({'_id': Integer}, 'results', self.engine, dedupe_key=('unitResultID',))
+
+class TestUpsert(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.table = dynamic_schema.create_dynamic_table(
+            {'_id': Integer, 'clearingPrice': Float, 'postCode': String}, 'results', self.engine, upsert=True)
+        dynamic_schema.save_results([{'_id': 1, 'clearingPrice': 5, 'postCode': 'TN17'},
+                                     {'_id': 2, 'clearingPrice': 6, 'postCode': 'TN18'}],
+                                    self.table, self.engine, upsert=True)
+
+    def stored_prices(self):
+        with self.engine.connect() as connection:
+            query = select(self.table.c._id, self.table.c.clearingPrice).order_by(self.table.c._id)
+            return [tuple(row) for row in connection.execute(query)]
+
+    def test_only_changed_records_are_updated(self):
+        records = [{'_id': 1, 'clearingPrice': 5, 'postCode': 'TN17'},
+                   {'_id': 2, 'clearingPrice': 7, 'postCode': 'TN18'},
+                   {'_id': 3, 'clearingPrice': 8, 'postCode': 'TN19'}]
+
+        counts = dynamic_schema.save_results(records, self.table, self.engine, upsert=True)
+
+        self.assertEqual(counts, (1, 1, 1))
+        self.assertEqual(self.stored_prices(), [(1, 5.0), (2, 7.0), (3, 8.0)])
+
+    def test_update_by_key_without_native_upsert(self):
+        with patch('db.dynamic_schema._native_upsert', return_value=None):
+            counts = dynamic_schema.save_results([{'_id': 2, 'clearingPrice': 9, 'postCode': 'TN18'}],
+                                                 self.table, self.engine, upsert=True)
+
+        self.assertEqual(counts, (0, 1, 0))
+        self.assertEqual(self.stored_prices(), [(1, 5.0), (2, 9.0)])
+
+    def test_native_upsert_without_a_multi_row_count(self):
+        records = [{'_id': 2, 'clearingPrice': 9, 'postCode': 'TN18'},
+                   {'_id': 3, 'clearingPrice': 8, 'postCode': 'TN19'}]
+
+        with patch.object(self.engine.dialect, 'supports_sane_multi_rowcount', False):
+            statements = dynamic_schema._statements(self.table, self.engine.dialect, ('_id',), True)
+            counts = dynamic_schema.save_results(records, self.table, self.engine, upsert=True)
+
+        self.assertIsNotNone(statements.upsert)
+        self.assertEqual(counts, (1, 1, 0))
+        self.assertEqual(self.stored_prices(), [(1, 5.0), (2, 9.0), (3, 8.0)])
+
+    def test_hash_column_is_added_to_existing_tables(self):
+        engine = create_engine('sqlite://')
+        dynamic_schema.create_dynamic_table({'_id': Integer, 'postCode': String}, 'results', engine)
+        dynamic_schema.save_results([{'_id': 1, 'postCode': 'TN17'}], dynamic_schema.create_dynamic_table(
+            {}, 'results', engine), engine)
+
+        table = dynamic_schema.create_dynamic_table({}, 'results', engine, upsert=True)
+        counts = dynamic_schema.save_results([{'_id': 1, 'postCode': 'TN17'}], table, engine, upsert=True)
+
+        self.assertIn(dynamic_schema.HASH_COLUMN, [c['name'] for c in inspect(engine).get_columns('results')])
+        self.assertEqual(counts, (0, 1, 0))
+
+class TestRowConverter(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.table = dynamic_schema.create_dynamic_table(
+            {'_id': Integer, 'deliveryStart': DateTime, 'clearedVolume': Float, 'postCode': String},
+            'results', self.engine)
+
+    def test_only_typed_columns_are_coerced(self):
+        convert = dynamic_schema.compile_row_converter(self.table)
+
+        row = convert({'_id': 1, 'deliveryStart': '2024-08-06T22:00:00', 'clearedVolume': 5,
+                       'postCode': '2024-08-06'})
+
+        self.assertEqual(row['deliveryStart'], datetime.datetime(2024, 8, 6, 22, 0))
+        self.assertIsInstance(row['clearedVolume'], float)
+        self.assertEqual(row['postCode'], '2024-08-06')
+
+    def test_records_are_not_modified(self):
+        record = {'_id': 1, 'deliveryStart': '2024-08-06T22:00:00', 'clearedVolume': None}
+
+        rows = dynamic_schema.convert_rows([record], self.table)
+
+        self.assertEqual(record['deliveryStart'], '2024-08-06T22:00:00')
+        self.assertIsNone(rows[0]['clearedVolume'])
+        self.assertEqual(rows[0]['deliveryStart'], datetime.datetime(2024, 8, 6, 22, 0))
+
+    def test_reflected_table_compiles_the_same_plan(self):
+        reflected = dynamic_schema.create_dynamic_table({}, 'results', self.engine)
+
+        row = dynamic_schema.compile_row_converter(reflected)({'deliveryStart': '2024-08-06T22:00:00Z'})
+
+        self.assertEqual(row['deliveryStart'], datetime.datetime(2024, 8, 6, 22, 0, tzinfo=datetime.timezone.utc))
+
 if __name__ == '__main__':
     unittest.main()
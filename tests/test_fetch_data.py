@@ -1,13 +1,15 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from api.fetch_data import fetch_auction_results
+from api.fetch_data import fetch_auction_results, iter_auction_pages, build_page_query, filter_results, EsoApiClient
+from api.fetch_data import detect_fields
+from sqlalchemy import Integer, Float, DateTime, String, Boolean
 import requests
 import json
-from datetime import datetime 
+from datetime import datetime, date
 
 class TestFetchAuctionResults(unittest.TestCase):
 
-    @patch('api.fetch_data.requests.post')
+    @patch('api.fetch_data.requests.Session.post')
     def test_fetch_auction_results(self, mock_post):
         # Mock response data
         mock_response = MagicMock()
@@ -56,7 +58,7 @@ class TestFetchAuctionResults(unittest.TestCase):
         self.assertIsInstance(records[0]['executedQuantity'], float)
         self.assertIsInstance(records[0]['clearingPrice'], float)
 
-    @patch('api.fetch_data.requests.post')
+    @patch('api.fetch_data.requests.Session.post')
     def test_fetch_auction_results_http_error(self, mock_post):
         # Setup mock response
         mock_response = MagicMock()
@@ -69,7 +71,7 @@ class TestFetchAuctionResults(unittest.TestCase):
         # Assertions
         self.assertEqual(results, [])
 
-    @patch('api.fetch_data.requests.post')
+    @patch('api.fetch_data.requests.Session.post')
     def test_fetch_auction_results_api_error(self, mock_post):
         # Setup mock response
         mock_response = MagicMock()
@@ -88,7 +90,7 @@ class TestFetchAuctionResults(unittest.TestCase):
         # Assertions
         self.assertEqual(results, [])
 
-    @patch('api.fetch_data.requests.post')
+    @patch('api.fetch_data.requests.Session.post')
     def test_fetch_auction_results_json_decode_error(self, mock_post):
         # Setup mock to raise JSONDecodeError
         mock_post.side_effect = json.JSONDecodeError("Expecting value", "", 0)
@@ -99,7 +101,7 @@ class TestFetchAuctionResults(unittest.TestCase):
         # Assertions
         self.assertEqual(results, [])
 
-    @patch('api.fetch_data.requests.post')
+    @patch('api.fetch_data.requests.Session.post')
     def test_fetch_auction_results_request_exception(self, mock_post):
         # Setup mock to raise RequestException
         mock_post.side_effect = requests.RequestException("Network error")
@@ -110,5 +112,303 @@ class TestFetchAuctionResults(unittest.TestCase):
         # Assertions
         self.assertEqual(results, [])
 
+class TestDateWindow(unittest.TestCase):
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_delivery_end_window_sent_to_server(self, mock_post):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"success": True, "result": {"records": []}}
+        mock_post.return_value = mock_response
+
+        fetch_auction_results("HABITAT ENERGY LIMITED", start_date=date(2024, 8, 6))
+
+        sql = json.loads(mock_post.call_args.kwargs['data'])['sql']
+        self.assertIn('"deliveryEnd" >= \'2024-08-06\'', sql)
+        self.assertIn('"deliveryEnd" < \'2024-08-07\'', sql)
+
+    def test_filter_results_keeps_requested_days(self):
+        records = [
+            {"_id": 1, "deliveryEnd": "2024-08-05T23:00:00"},
+            {"_id": 2, "deliveryEnd": "2024-08-06T22:00:00"},
+            {"_id": 3, "deliveryEnd": "2024-08-07T02:00:00"},
+            {"_id": 4, "deliveryEnd": "2024-08-08T02:00:00"},
+        ]
+
+        filtered = filter_results(records, date(2024, 8, 6), date(2024, 8, 7))
+
+        self.assertEqual([r["_id"] for r in filtered], [2, 3])
+
+class TestStreamedFetch(unittest.TestCase):
+
+    @patch('api.fetch_data.STREAM_RESPONSES', True)
+    @patch('api.fetch_data.requests.Session.post')
+    def test_streamed_records_are_filtered(self, mock_post):
+        body = json.dumps({
+            "success": True,
+            "result": {"records": [
+                {"_id": 1, "deliveryEnd": "2024-08-06T22:00:00", "_full_text": "'habitat'"},
+                {"_id": 2, "deliveryEnd": "2024-08-07T22:00:00", "_full_text": "'habitat'"},
+            ]}
+        }).encode('utf-8')
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.iter_content.return_value = [body[i:i + 16] for i in range(0, len(body), 16)]
+        mock_post.return_value = mock_response
+
+        records = fetch_auction_results("HABITAT ENERGY LIMITED", start_date=date(2024, 8, 6))
+
+        self.assertEqual(records, [{"_id": 1, "deliveryEnd": "2024-08-06T22:00:00"}])
+        self.assertTrue(mock_post.call_args.kwargs['stream'])
+        mock_response.json.assert_not_called()
+        mock_response.close.assert_called_once()
+
+    @patch('api.fetch_data.STREAM_RESPONSES', True)
+    @patch('api.fetch_data.requests.Session.post')
+    def test_streamed_api_error(self, mock_post):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.iter_content.return_value = [b'{"success": false, "error": {"message": "Invalid request"}}']
+        mock_post.return_value = mock_response
+
+        self.assertEqual(fetch_auction_results("HABITAT ENERGY LIMITED"), [])
+
+class TestEsoApiClient(unittest.TestCase):
+
+    @staticmethod
+    def response(status_code):
+        response = MagicMock()
+        response.status_code = status_code
+        return response
+
+    def test_session_negotiates_gzip(self):
+        client = EsoApiClient()
+        self.assertEqual(client.session.headers['Accept-Encoding'], 'gzip')
+        self.assertEqual(client.session.get_adapter('https://api.nationalgrideso.com')._pool_maxsize, 10)
+
+    @patch('api.fetch_data.time.sleep')
+    def test_retries_retryable_status_with_backoff(self, mock_sleep):
+        client = EsoApiClient(max_retries=3, backoff_factor=0.5)
+        client.session.post = MagicMock(side_effect=[self.response(503), self.response(502), self.response(200)])
+
+        response = client.post("https://example.invalid", {"sql": "SELECT 1"}, stream=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session.post.call_count, 3)
+        self.assertTrue(client.session.post.call_args.kwargs['stream'])
+        delays = [c.args[0] for c in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0)
+
+    @patch('api.fetch_data.time.sleep')
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        client = EsoApiClient(max_retries=2)
+        client.session.post = MagicMock(return_value=self.response(500))
+
+        self.assertEqual(client.post("https://example.invalid", {}).status_code, 500)
+        self.assertEqual(client.session.post.call_count, 3)
+
+    @patch('api.fetch_data.time.sleep')
+    def test_retries_connection_errors(self, mock_sleep):
+        client = EsoApiClient(max_retries=1)
+        client.session.post = MagicMock(side_effect=[requests.ConnectionError("reset"), self.response(200)])
+
+        self.assertEqual(client.post("https://example.invalid", {}).status_code, 200)
+
+    def test_does_not_retry_client_errors(self):
+        client = EsoApiClient()
+        client.session.post = MagicMock(return_value=self.response(404))
+
+        self.assertEqual(client.post("https://example.invalid", {}).status_code, 404)
+        self.assertEqual(client.session.post.call_count, 1)
+
+class TestParallelPages(unittest.TestCase):
+
+    ids = list(range(1, 101, 3))  # 34 sparse rows between _id 1 and 100
+
+    def fake_post(self, url, data=None, **kwargs):
+        sql = json.loads(data)['sql']
+        response = MagicMock()
+        response.status_code = 200
+        after_id = int(sql.split('"_id" > ')[1].split()[0])
+        matching = [i for i in self.ids if i > after_id]
+        if sql.startswith('SELECT COUNT(*)'):
+            records = [{"total": len(matching), "min_id": min(matching), "max_id": max(matching)}]
+        else:
+            if '"_id" <= ' in sql:
+                until_id = int(sql.split('"_id" <= ')[1].split()[0])
+                matching = [i for i in matching if i <= until_id]
+            limit = int(sql.rsplit('LIMIT ', 1)[1])
+            records = [{"_id": i} for i in matching[:limit]]
+        response.json.return_value = {"success": True, "result": {"records": records}}
+        return response
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_parallel_pages_are_complete_and_ordered(self, mock_post):
+        mock_post.side_effect = self.fake_post
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=5, after_id=10, concurrency=3))
+
+        self.assertEqual([r["_id"] for page in pages for r in page], [i for i in self.ids if i > 10])
+        self.assertTrue(all(len(page) <= 5 for page in pages))
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_small_result_falls_back_to_sequential(self, mock_post):
+        mock_post.side_effect = self.fake_post
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=50, concurrency=3))
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(mock_post.call_count, 2)
+
+    def test_uncached_pages_bypass_the_response_cache(self):
+        def fake_post(url, payload, **kwargs):
+            return self.fake_post(url, json.dumps(payload))
+
+        with patch('api.fetch_data.api_client.post', side_effect=fake_post) as mock_post:
+            pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=5, concurrency=3, cache=False))
+
+        self.assertEqual([r["_id"] for page in pages for r in page], self.ids)
+        # The count query and every page request
+        self.assertEqual({call.kwargs['cache'] for call in mock_post.call_args_list}, {False})
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_failed_shard_stops_iteration(self, mock_post):
+        def failing_post(url, data=None, **kwargs):
+            # Fails the fourth of the seven _id shards: (45, 60]
+            if '"_id" > 45 ' in json.loads(data)['sql']:
+                response = MagicMock()
+                response.status_code = 404
+                return response
+            return self.fake_post(url, data)
+        mock_post.side_effect = failing_post
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=5, concurrency=2))
+
+        # Shards before the failed one are returned, nothing after it
+        self.assertEqual([r["_id"] for page in pages for r in page], [i for i in self.ids if i <= 45])
+
+class TestIterAuctionPages(unittest.TestCase):
+
+    @staticmethod
+    def page_response(ids):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {
+            "success": True,
+            "result": {
+                "records": [{"_id": _id, "_full_text": "'habitat'", "deliveryEnd": "2024-08-06T22:00:00"} for _id in ids]
+            }
+        }
+        return response
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_pages_follow_keyset_cursor(self, mock_post):
+        mock_post.side_effect = [self.page_response([1, 2]), self.page_response([3])]
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=2))
+
+        self.assertEqual([[r["_id"] for r in page] for page in pages], [[1, 2], [3]])
+        self.assertNotIn("_full_text", pages[0][0])
+        # The second request continues after the last _id of the first page, not at an offset
+        second_sql = json.loads(mock_post.call_args_list[1].kwargs['data'])['sql']
+        self.assertIn('"_id" > 2', second_sql)
+        self.assertIn('ORDER BY "_id" LIMIT 2', second_sql)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_pages_stop_on_empty_page(self, mock_post):
+        mock_post.side_effect = [self.page_response([1, 2]), self.page_response([])]
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=2))
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_pages_stop_on_http_error(self, mock_post):
+        error_response = MagicMock()
+        error_response.status_code = 404
+        mock_post.side_effect = [self.page_response([1, 2]), error_response]
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=2))
+
+        self.assertEqual(len(pages), 1)
+
+    def test_build_page_query_escapes_literals(self):
+        sql = build_page_query("res", {"registeredAuctionParticipant": "O'BRIEN LTD"}, 10, 500)
+        self.assertEqual(
+            sql,
+            'SELECT * FROM "res" WHERE "_id" > 10 AND "registeredAuctionParticipant" = \'O\'\'BRIEN LTD\' '
+            'ORDER BY "_id" LIMIT 500'
+        )
+
+class TestFieldProjection(unittest.TestCase):
+
+    def test_query_selects_projected_and_mandatory_fields(self):
+        sql = build_page_query("res", {}, 0, 10, fields=["clearingPrice", "_id"])
+        self.assertTrue(sql.startswith('SELECT "_id", "deliveryStart", "deliveryEnd", "clearingPrice" FROM "res"'))
+
+    def test_query_without_projection_selects_all(self):
+        self.assertTrue(build_page_query("res", {}, 0, 10).startswith('SELECT * FROM "res"'))
+
+    def test_detect_fields_honours_projection(self):
+        records = [{"_id": 1, "deliveryStart": "2024-08-06T17:00:00", "deliveryEnd": "2024-08-06T22:00:00",
+                    "clearingPrice": 1.58, "postCode": "TN17", "unitResultID": "579#||#87#||#DCH#||#24070"}]
+
+        fields = detect_fields(records, fields=["clearingPrice"])
+
+        self.assertEqual(list(fields), ["_id", "deliveryStart", "deliveryEnd", "clearingPrice"])
+
+class TestInferredSchema(unittest.TestCase):
+
+    def test_inferred_types_are_widened(self):
+        records = [
+            {"_id": 1, "executedQuantity": 36, "accepted": True, "postCode": None},
+            {"_id": 2, "executedQuantity": 36.5, "accepted": False, "postCode": "TN17"},
+        ]
+
+        field_types = detect_fields(records)
+
+        self.assertEqual(field_types, {"_id": Integer, "executedQuantity": Float, "accepted": Boolean,
+                                       "postCode": String})
+
+class TestDeclaredSchema(unittest.TestCase):
+
+    fields = [
+        {"id": "_id", "type": "int4"},
+        {"id": "executedQuantity", "type": "numeric"},
+        {"id": "clearingPrice", "type": "numeric"},
+        {"id": "deliveryEnd", "type": "timestamp"},
+        {"id": "postCode", "type": "text"},
+        {"id": "_full_text", "type": "tsvector"},
+    ]
+
+    @patch('api.fetch_data.requests.Session.post')
+    def test_declared_types_are_used(self, mock_post):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"success": True, "result": {"fields": self.fields, "records": [
+            # An integral first value would otherwise make clearingPrice an Integer column
+            {"_id": 1, "executedQuantity": 36, "clearingPrice": 2, "deliveryEnd": "2024-08-06T22:00:00",
+             "postCode": "TN17", "_full_text": "'tn17'"},
+        ]}}
+        mock_post.return_value = mock_response
+        schema = {}
+
+        pages = list(iter_auction_pages("HABITAT ENERGY LIMITED", page_size=10, schema=schema))
+        field_types = detect_fields(pages[0], schema=schema)
+
+        self.assertNotIn("_full_text", schema)
+        self.assertEqual(field_types, {"_id": Integer, "executedQuantity": Float, "clearingPrice": Float,
+                                       "deliveryEnd": DateTime, "postCode": String})
+
+    def test_untyped_fields_fall_back_to_inference(self):
+        records = [{"_id": 1, "deliveryStart": "2024-08-06T17:00:00", "auctionUnit": "HAB6-FFR"}]
+
+        field_types = detect_fields(records, schema={"_id": "int4", "auctionUnit": "_text"})
+
+        self.assertEqual(field_types, {"_id": Integer, "deliveryStart": DateTime, "auctionUnit": String})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import patch
+from sqlalchemy import select
+
+import backfill
+from db import dynamic_schema, jobs
+from tests.test_backfill import fake_pages
+from utils.resources import Resource
+
+SHARDS = [(date(2024, 8, 1), date(2024, 8, 1)), (date(2024, 8, 2), date(2024, 8, 2))]
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = dynamic_schema.get_engine(f"sqlite:///{os.path.join(directory.name, 'jobs.db')}")
+
+    def statuses(self):
+        with self.engine.connect() as connection:
+            return dict(connection.execute(select(jobs.ingest_jobs.c.shard_start, jobs.ingest_jobs.c.status)).all())
+
+    def test_enqueue_is_idempotent(self):
+        self.assertEqual(jobs.enqueue_jobs(self.engine, 'results', SHARDS), 2)
+        self.assertEqual(jobs.enqueue_jobs(self.engine, 'results', SHARDS), 0)
+        self.assertEqual(jobs.count_unfinished(self.engine), 2)
+
+    def test_each_job_is_claimed_by_one_worker(self):
+        jobs.enqueue_jobs(self.engine, 'results', SHARDS)
+
+        first = jobs.claim_job(self.engine, 'host-a')
+        second = jobs.claim_job(self.engine, 'host-b')
+
+        self.assertEqual({first.shard_start, second.shard_start}, {date(2024, 8, 1), date(2024, 8, 2)})
+        self.assertIsNone(jobs.claim_job(self.engine, 'host-c'))
+        self.assertFalse(jobs.renew_lease(self.engine, first, 'host-b'))
+        self.assertTrue(jobs.renew_lease(self.engine, first, 'host-a'))
+
+    def test_expired_lease_is_claimed_again(self):
+        jobs.enqueue_jobs(self.engine, 'results', SHARDS[:1])
+        crashed = jobs.claim_job(self.engine, 'host-a', lease_seconds=0)
+
+        job = jobs.claim_job(self.engine, 'host-b')
+
+        self.assertEqual((job.shard_start, job.attempts), (crashed.shard_start, 2))
+        self.assertFalse(jobs.complete_job(self.engine, crashed, 'host-a'))
+        self.assertTrue(jobs.complete_job(self.engine, job, 'host-b'))
+        self.assertEqual(self.statuses(), {date(2024, 8, 1): jobs.DONE})
+        self.assertEqual(jobs.count_unfinished(self.engine), 0)
+
+    def test_job_fails_after_max_attempts(self):
+        jobs.enqueue_jobs(self.engine, 'results', SHARDS[:1])
+
+        for attempt in range(2):
+            job = jobs.claim_job(self.engine, 'host-a', max_attempts=2)
+            jobs.release_job(self.engine, job, 'host-a', failed=True, max_attempts=2)
+
+        self.assertIsNone(jobs.claim_job(self.engine, 'host-a', max_attempts=2))
+        self.assertEqual(self.statuses(), {date(2024, 8, 1): jobs.FAILED})
+
+    def test_released_job_keeps_its_attempts(self):
+        jobs.enqueue_jobs(self.engine, 'results', SHARDS[:1])
+        jobs.release_job(self.engine, jobs.claim_job(self.engine, 'host-a'), 'host-a')
+
+        self.assertEqual(jobs.claim_job(self.engine, 'host-b').attempts, 1)
+
+class TestDistributedBackfill(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database_url = f"sqlite:///{os.path.join(directory.name, 'results.db')}"
+        self.resource = Resource(name='results_by_unit', resource_id='a63ab354', table_name='results',
+                                 database_url=database_url, participant_name='HABITAT ENERGY LIMITED',
+                                 page_size=100, limit=100, fetch_concurrency=1)
+        self.engine = dynamic_schema.get_engine(database_url)
+
+    @patch('pipeline.iter_auction_results', side_effect=fake_pages)
+    def test_shards_done_by_another_worker_are_skipped(self, mock_pages):
+        jobs.enqueue_jobs(self.engine, 'results_by_unit', SHARDS)
+        other = jobs.claim_job(self.engine, 'host-b')
+        jobs.complete_job(self.engine, other, 'host-b')
+
+        failed = backfill.backfill([self.resource], date(2024, 8, 1), date(2024, 8, 3), workers=2,
+                                   executor=ThreadPoolExecutor(2), distributed=True)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(jobs.count_unfinished(self.engine), 0)
+        fetched = sorted(call.args[2] for call in mock_pages.call_args_list)
+        # The table probe, then the two shards left to this worker
+        self.assertEqual(fetched, [date(2024, 8, 1), date(2024, 8, 2), date(2024, 8, 3)])
+
+    @patch('pipeline.iter_auction_results', side_effect=fake_pages)
+    def test_only_shards_of_the_range_are_claimed(self, mock_pages):
+        today = date(2026, 10, 18)
+        sync_job = jobs.sync_job_name('results_by_unit')
+        jobs.enqueue_jobs(self.engine, sync_job, [(today, today)])
+        jobs.enqueue_jobs(self.engine, 'results_by_unit', [(today, today)])
+
+        failed = backfill.backfill([self.resource], date(2024, 8, 1), date(2024, 8, 2), workers=1,
+                                   executor=ThreadPoolExecutor(1), distributed=True)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(jobs.count_unfinished(self.engine, ['results_by_unit']), 1)
+        job = jobs.claim_job(self.engine, 'host-b', [sync_job], within=(today, today))
+        self.assertEqual((job.resource, job.shard_start), (sync_job, today))
+
+    @patch('pipeline.iter_auction_results')
+    def test_failing_shard_is_retried_until_max_attempts(self, mock_pages):
+        def pages(participant_name, page_size, start_date, end_date, *args, **kwargs):
+            if start_date == date(2024, 8, 2):
+                raise ConnectionError("HTTP 503")
+            return fake_pages(participant_name, page_size, start_date, end_date)
+        mock_pages.side_effect = pages
+
+        failed = backfill.backfill([self.resource], date(2024, 8, 1), date(2024, 8, 2), workers=1,
+                                   executor=ThreadPoolExecutor(1), distributed=True)
+
+        self.assertEqual(failed, [('results_by_unit', date(2024, 8, 2), date(2024, 8, 2))])
+        attempts = [call for call in mock_pages.call_args_list if call.args[2] == date(2024, 8, 2)]
+        self.assertEqual(len(attempts), jobs.MAX_ATTEMPTS)
+
+if __name__ == '__main__':
+    unittest.main()
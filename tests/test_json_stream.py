@@ -0,0 +1,61 @@
+import unittest
+import json
+
+from api.json_stream import iter_records
+
+class TestIterRecords(unittest.TestCase):
+
+    payload = {
+        "help": "https://api.nationalgrideso.com/api/3/action/help_show?name=datastore_search",
+        "success": True,
+        "result": {
+            "fields": [{"id": "_id", "type": "int"}, {"id": "clearingPrice", "type": "numeric"}],
+            "records": [
+                {"_id": 1, "clearingPrice": 1.58, "postCode": "TN17", "note": "café \"quoted\" }]"},
+                {"_id": 22, "clearingPrice": -3, "postCode": None, "flags": [True, False]},
+                {"_id": 333, "clearingPrice": 12345.678, "nested": {"a": [1, {"b": 2}]}},
+            ],
+            "total": 3
+        }
+    }
+
+    def test_records_and_envelope_match_json_loads(self):
+        body = json.dumps(self.payload, ensure_ascii=False).encode('utf-8')
+        envelope = {}
+
+        records = list(iter_records([body], envelope))
+
+        self.assertEqual(records, self.payload['result']['records'])
+        self.assertTrue(envelope['success'])
+        self.assertEqual(envelope['result']['total'], 3)
+        self.assertEqual(envelope['result']['fields'], self.payload['result']['fields'])
+        self.assertNotIn('records', envelope['result'])
+
+    def test_any_chunk_boundary(self):
+        # Split the body at every byte, including inside numbers and multi-byte characters
+        body = json.dumps(self.payload, ensure_ascii=False, indent=1).encode('utf-8')
+        for size in (1, 2, 3, 7, 64):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            with self.subTest(chunk_size=size):
+                self.assertEqual(list(iter_records(chunks)), self.payload['result']['records'])
+
+    def test_is_lazy(self):
+        def chunks():
+            yield b'{"success": true, "result": {"records": [{"_id": 1}, '
+            raise AssertionError("read past the first record")
+
+        self.assertEqual(next(iter_records(chunks())), {"_id": 1})
+
+    def test_error_response_has_no_records(self):
+        envelope = {}
+        records = list(iter_records([b'{"success": false, "error": {"message": "Invalid request"}}'], envelope))
+
+        self.assertEqual(records, [])
+        self.assertEqual(envelope['error']['message'], "Invalid request")
+
+    def test_truncated_body_raises(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_records([b'{"success": true, "result": {"records": [{"_id": 1}, {"_id"']))
+
+if __name__ == '__main__':
+    unittest.main()
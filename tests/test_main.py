@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import tempfile
+import threading
+from dataclasses import replace
+
+import main
+from utils import run_lock
+from utils.fingerprints import load_fingerprints, save_fingerprint
+from utils.run_lock import RunLock
+
+class TestSkipIfUnchanged(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fingerprint_file = os.path.join(directory.name, 'fingerprints.json')
+        patcher = patch.object(main, 'FINGERPRINT_FILE', self.fingerprint_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lock_file = os.path.join(directory.name, 'ingest.lock')
+        patcher = patch.object(main, 'LOCK_FILE', self.lock_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.resource = main.load_resources(main.config)[0]
+
+    @patch('main.fetch_resource_fingerprint', return_value='2024-08-06T10:00:00')
+    @patch('pipeline.ingest_resource')
+    def test_unchanged_resource_is_skipped(self, mock_ingest, mock_fingerprint):
+        save_fingerprint(self.fingerprint_file, main.fingerprint_key(self.resource),
+                         main.upstream_fingerprint(self.resource))
+
+        main.main()
+
+        mock_ingest.assert_not_called()
+
+    @patch('main.fetch_resource_fingerprint', return_value='2024-08-07T10:00:00')
+    @patch('pipeline.ingest_resource')
+    def test_changed_resource_is_ingested_and_fingerprinted(self, mock_ingest, mock_fingerprint):
+        save_fingerprint(self.fingerprint_file, main.fingerprint_key(self.resource), 'stale')
+
+        main.main()
+
+        mock_ingest.assert_called_once_with(self.resource, False, False)
+        self.assertEqual(load_fingerprints(self.fingerprint_file)[main.fingerprint_key(self.resource)],
+                         main.upstream_fingerprint(self.resource))
+
+    @patch('main.fetch_resource_fingerprint', return_value='2024-08-07T10:00:00')
+    @patch('pipeline.ingest_resource', side_effect=Exception("HTTP 500"))
+    def test_failed_ingest_keeps_old_fingerprint(self, mock_ingest, mock_fingerprint):
+        save_fingerprint(self.fingerprint_file, main.fingerprint_key(self.resource), 'stale')
+
+        main.main()
+
+        self.assertEqual(load_fingerprints(self.fingerprint_file)[main.fingerprint_key(self.resource)], 'stale')
+
+    @patch('main.fetch_resource_fingerprint', return_value='2024-08-07T10:00:00')
+    @patch('pipeline.ingest_resource')
+    def test_sections_sharing_a_resource_keep_their_own_fingerprint(self, mock_ingest, mock_fingerprint):
+        other = replace(self.resource, name='other_participant', participant_name='OTHER LIMITED')
+        save_fingerprint(self.fingerprint_file, main.fingerprint_key(self.resource),
+                         main.upstream_fingerprint(self.resource))
+
+        with patch('main.load_resources', return_value=[self.resource, other]):
+            main.main()
+
+        mock_ingest.assert_called_once_with(other, False, False)
+
+class TestRunLock(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.lock_file = os.path.join(directory.name, 'ingest.lock')
+        patchers = [patch.object(main, 'LOCK_FILE', self.lock_file), patch.object(run_lock, 'POLL_INTERVAL', 0.01)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('main.run', return_value=main.RunOutcome(True, True))
+    def test_overlapping_run_exits(self, mock_run):
+        holder = RunLock(self.lock_file)
+        self.assertTrue(holder.acquire())
+        self.addCleanup(holder.release)
+
+        main.main()
+
+        mock_run.assert_not_called()
+
+    @patch('main.run', return_value=main.RunOutcome(True, True))
+    def test_waiting_run_reuses_successful_outcome(self, mock_run):
+        holder = RunLock(self.lock_file)
+        holder.acquire()
+        threading.Timer(0.1, holder.release, args=(True,)).start()
+
+        main.main(if_running='wait')
+
+        mock_run.assert_not_called()
+
+    @patch('main.run', return_value=main.RunOutcome(True, True))
+    def test_waiting_run_retries_after_failed_run(self, mock_run):
+        holder = RunLock(self.lock_file)
+        holder.acquire()
+        threading.Timer(0.1, holder.release, args=(False,)).start()
+
+        main.main(if_running='wait')
+
+        mock_run.assert_called_once_with(False, False, False)
+        self.assertTrue(RunLock(self.lock_file).outcome()['succeeded'])
+
+class TestDaemon(unittest.TestCase):
+
+    @patch('main.main')
+    def test_polls_until_stopped_and_backs_off_when_unchanged(self, mock_main):
+        stop = threading.Event()
+        outcomes = [main.RunOutcome(True, True), main.RunOutcome(True, False), None]
+
+        def poll(full_resync, distributed, restart):
+            if len(outcomes) == 1:
+                stop.set()
+            return outcomes.pop(0)
+        mock_main.side_effect = poll
+        schedule = MagicMock()
+        schedule.next_delay.return_value = 0
+
+        main.daemon(full_resync=True, schedule=schedule, stop=stop, restart=True)
+
+        self.assertEqual([(*call.args, call.kwargs['restart']) for call in mock_main.call_args_list],
+                         [(True, False, True), (False, False, False), (False, False, False)])
+        self.assertEqual([call.args for call in schedule.next_delay.call_args_list], [(True,), (False,), (False,)])
+
+if __name__ == '__main__':
+    unittest.main()
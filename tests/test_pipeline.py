@@ -0,0 +1,214 @@
+import os
+import tempfile
+import time
+import unittest
+from dataclasses import replace
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine, select
+
+import pipeline
+from db import dynamic_schema
+from utils.resources import Resource
+
+RESOURCE = Resource(name='results_by_unit', resource_id='a63ab354', table_name='results', database_url='sqlite://',
+                    participant_name='HABITAT ENERGY LIMITED', page_size=3, limit=100, fetch_concurrency=1,
+                    batch_size=2)
+
+def make_page(first_id, count):
+    return [{'_id': i, 'deliveryStart': '2024-08-06T22:00:00', 'deliveryEnd': '2024-08-07T02:00:00',
+             'auctionUnit': f'HAB{i}-FFR'} for i in range(first_id, first_id + count)]
+
+class TestIngestResource(unittest.TestCase):
+
+    def setUp(self):
+        # A file database: the writer thread needs to see the tables created by others
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = create_engine(f"sqlite:///{os.path.join(directory.name, 'results.db')}")
+        self.addCleanup(self.engine.dispose)
+        patcher = patch('pipeline.get_engine', return_value=self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored_ids(self):
+        table = dynamic_schema.create_dynamic_table({}, 'results', self.engine)
+        with self.engine.connect() as connection:
+            return connection.execute(select(table.c._id).order_by(table.c._id)).scalars().all()
+
+    def high_watermark(self, resource=RESOURCE, day=None):
+        key = pipeline.watermark_key(resource, day or date.today())
+        return dynamic_schema.get_high_watermark(key, self.engine)
+
+    @patch('pipeline.iter_auction_results')
+    def test_records_are_saved_in_batches(self, mock_pages):
+        mock_pages.return_value = iter([make_page(1, 3), [], make_page(4, 2)])
+
+        pipeline.ingest_resource(RESOURCE)
+
+        self.assertEqual(self.stored_ids(), [1, 2, 3, 4, 5])
+        # A sync follows a change upstream, so responses cached before it are not used
+        self.assertIs(mock_pages.call_args.kwargs['cache'], False)
+        self.assertEqual(self.high_watermark(), 5)
+
+    @patch('pipeline.INFERENCE_SAMPLE_SIZE', 1)
+    @patch('pipeline.QUEUE_SIZE', 1)
+    @patch('pipeline.iter_auction_results')
+    def test_fetching_runs_ahead_of_writes_by_a_bounded_amount(self, mock_pages):
+        fetched = []
+
+        def pages(*args, **kwargs):
+            for first_id in range(1, 60, 3):
+                fetched.append(first_id)
+                yield make_page(first_id, 3)
+        mock_pages.side_effect = pages
+        fetched_during_first_save = []
+        save_rows = pipeline.save_rows
+
+        def slow_save(rows, *args):
+            if not fetched_during_first_save:
+                time.sleep(0.3)
+                fetched_during_first_save.append(len(fetched))
+            return save_rows(rows, *args)
+
+        with patch('pipeline.save_rows', side_effect=slow_save):
+            pipeline.ingest_resource(RESOURCE)
+
+        self.assertGreater(fetched_during_first_save[0], 1)
+        self.assertLess(fetched_during_first_save[0], 20)
+        self.assertEqual(self.stored_ids(), list(range(1, 61)))
+
+    @patch('pipeline.iter_auction_results')
+    def test_sections_sharing_a_resource_keep_their_own_watermark(self, mock_pages):
+        other = replace(RESOURCE, name='other_participant', participant_name='OTHER LIMITED')
+        mock_pages.return_value = iter([make_page(1, 3)])
+        pipeline.ingest_resource(RESOURCE)
+
+        mock_pages.return_value = iter([])
+        pipeline.ingest_resource(other)
+
+        self.assertEqual(mock_pages.call_args.args[4], 0)
+        self.assertEqual(self.high_watermark(), 3)
+
+    @patch('pipeline.datetime')
+    @patch('pipeline.iter_auction_results')
+    def test_each_delivery_day_keeps_its_own_watermark(self, mock_pages, mock_datetime):
+        # _id 2 ends on the next day (overnight EFA block) and is published with the rows of the first
+        first_day, next_day = date(2024, 8, 6), date(2024, 8, 7)
+        mock_datetime.now.return_value = datetime(2024, 8, 6, 16)
+        mock_pages.return_value = iter([[{**row, '_id': i} for row, i in zip(make_page(1, 2), (1, 3))]])
+        pipeline.ingest_resource(RESOURCE)
+
+        mock_datetime.now.return_value = datetime(2024, 8, 7, 16)
+        mock_pages.return_value = iter([make_page(2, 1)])
+        pipeline.ingest_resource(RESOURCE)
+
+        self.assertEqual(mock_pages.call_args.args[2:5], (next_day, None, 0))
+        self.assertEqual(self.stored_ids(), [1, 2, 3])
+        self.assertEqual((self.high_watermark(day=first_day), self.high_watermark(day=next_day)), (3, 2))
+
+    @patch('pipeline.iter_auction_results')
+    def test_upsert_sync_applies_revisions_of_stored_records(self, mock_pages):
+        resource = replace(RESOURCE, upsert=True)
+        mock_pages.return_value = iter([make_page(1, 3)])
+        pipeline.ingest_resource(resource)
+
+        revised = make_page(1, 3)
+        revised[1]['auctionUnit'] = 'HAB2-DCH'
+        mock_pages.return_value = iter([revised])
+        pipeline.ingest_resource(resource)
+
+        self.assertEqual(mock_pages.call_args.args[4], 0)
+        table = dynamic_schema.create_dynamic_table({}, 'results', self.engine)
+        with self.engine.connect() as connection:
+            units = connection.execute(select(table.c.auctionUnit).order_by(table.c._id)).scalars().all()
+        self.assertEqual(units, ['HAB1-FFR', 'HAB2-DCH', 'HAB3-FFR'])
+
+    @patch('pipeline.INFERENCE_SAMPLE_SIZE', 1)
+    @patch('pipeline.iter_auction_results')
+    def test_watermark_stays_at_the_last_committed_batch(self, mock_pages):
+        def pages(*args, **kwargs):
+            yield make_page(1, 3)
+            raise ConnectionError("page 2 failed")
+        mock_pages.side_effect = pages
+
+        with self.assertRaises(ConnectionError):
+            pipeline.ingest_resource(RESOURCE)
+
+        self.assertEqual(self.high_watermark(), 2)
+
+    @patch('pipeline.iter_auction_results')
+    def test_batches_after_a_failed_write_are_skipped(self, mock_pages):
+        mock_pages.return_value = iter([make_page(1, 3), make_page(4, 3)])
+        save_rows = pipeline.save_rows
+        calls = []
+
+        def failing_save(rows, *args):
+            calls.append(rows)
+            if len(calls) == 1:
+                raise ValueError("disk full")
+            return save_rows(rows, *args)
+
+        with patch('pipeline.save_rows', side_effect=failing_save):
+            with self.assertRaises(ValueError):
+                pipeline.ingest_resource(RESOURCE)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.stored_ids(), [])
+        self.assertEqual(self.high_watermark(), 0)
+
+    @patch('pipeline.INFERENCE_SAMPLE_SIZE', 1)
+    @patch('pipeline.iter_auction_results')
+    def test_interrupted_full_resync_resumes_from_its_checkpoint(self, mock_pages):
+        def interrupted(*args, **kwargs):
+            yield make_page(1, 3)
+            raise ConnectionError("killed")
+        mock_pages.side_effect = interrupted
+        with self.assertRaises(ConnectionError):
+            pipeline.ingest_resource(RESOURCE, full_resync=True)
+
+        mock_pages.side_effect = None
+        mock_pages.return_value = iter([make_page(3, 3)])
+        pipeline.ingest_resource(RESOURCE, full_resync=True)
+
+        self.assertEqual(mock_pages.call_args.args[4], 2)
+        self.assertEqual(self.stored_ids(), [1, 2, 3, 4, 5])
+        self.assertIsNone(dynamic_schema.latest_checkpoint('resync:', self.engine))
+
+        # A completed resync is not resumed
+        mock_pages.return_value = iter([])
+        pipeline.ingest_resource(RESOURCE, full_resync=True)
+        self.assertEqual(mock_pages.call_args.args[4], 0)
+
+    @patch('pipeline.INFERENCE_SAMPLE_SIZE', 1)
+    @patch('pipeline.iter_auction_results')
+    def test_stale_or_restarted_resync_starts_over(self, mock_pages):
+        def interrupted(*args, **kwargs):
+            yield make_page(1, 3)
+            raise ConnectionError("killed")
+        for resume_within, restart in [(pipeline.RESUME_WITHIN, True), (timedelta(0), False)]:
+            with self.subTest(restart=restart):
+                mock_pages.side_effect = interrupted
+                with self.assertRaises(ConnectionError):
+                    pipeline.ingest_resource(RESOURCE, full_resync=True)
+
+                mock_pages.side_effect = None
+                mock_pages.return_value = iter([])
+                with patch('pipeline.RESUME_WITHIN', resume_within):
+                    pipeline.ingest_resource(RESOURCE, full_resync=True, restart=restart)
+
+                self.assertEqual(mock_pages.call_args.args[4], 0)
+
+    @patch('pipeline.iter_auction_results')
+    def test_table_is_reflected_once_per_process(self, mock_pages):
+        mock_pages.side_effect = lambda *args, **kwargs: iter([make_page(1, 3)])
+
+        with patch('pipeline.create_dynamic_table', wraps=pipeline.create_dynamic_table) as create_table:
+            pipeline.ingest_resource(RESOURCE)
+            pipeline.ingest_resource(RESOURCE)
+
+        self.assertEqual(create_table.call_count, 1)
+        self.assertEqual(self.stored_ids(), [1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
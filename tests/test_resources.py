@@ -0,0 +1,71 @@
+import unittest
+import configparser
+
+from utils.resources import load_resources
+
+DEFAULTS = """
+[database]
+url = sqlite:///auction_results.db
+
+[api]
+resource_id = a63ab354-7e68-44c2-ad96-c6f920c30e85
+limit = 9999999
+page_size = 5000
+participant_name = HABITAT ENERGY LIMITED
+"""
+
+def make_config(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return config
+
+class TestLoadResources(unittest.TestCase):
+
+    def test_legacy_single_resource(self):
+        resources = load_resources(make_config(DEFAULTS))
+
+        self.assertEqual(len(resources), 1)
+        self.assertEqual(resources[0].resource_id, 'a63ab354-7e68-44c2-ad96-c6f920c30e85')
+        self.assertEqual(resources[0].table_name, 'auction_results_a63ab354')
+        self.assertEqual(resources[0].database_url, 'sqlite:///auction_results.db')
+
+    def test_resource_sections_override_defaults(self):
+        resources = load_resources(make_config(DEFAULTS + """
+[resource:results_by_unit]
+resource_id = a63ab354-7e68-44c2-ad96-c6f920c30e85
+
+[resource:sell_orders]
+resource_id = 13b511df-d6ec-4143-afb1-0ecc6fd19810
+table = sell_orders
+database = sqlite:///auction_results_2.db
+page_size = 100
+upsert = true
+dedupe_key = auctionUnit, deliveryStart
+"""))
+
+        self.assertEqual([r.name for r in resources], ['results_by_unit', 'sell_orders'])
+        results_by_unit, sell_orders = resources
+        self.assertEqual(results_by_unit.database_url, 'sqlite:///auction_results.db')
+        self.assertEqual(results_by_unit.page_size, 5000)
+        self.assertEqual(sell_orders.table_name, 'sell_orders')
+        self.assertEqual(sell_orders.database_url, 'sqlite:///auction_results_2.db')
+        self.assertEqual(sell_orders.page_size, 100)
+        self.assertEqual(sell_orders.participant_name, 'HABITAT ENERGY LIMITED')
+        self.assertFalse(results_by_unit.upsert)
+        self.assertTrue(sell_orders.upsert)
+        self.assertEqual(results_by_unit.dedupe_key, ('_id',))
+        self.assertEqual(sell_orders.dedupe_key, ('auctionUnit', 'deliveryStart'))
+
+    def test_field_list(self):
+        resources = load_resources(make_config(DEFAULTS + """
+[resource:results_by_unit]
+fields = auctionUnit, clearingPrice ,
+"""))
+
+        self.assertEqual(resources[0].fields, ('auctionUnit', 'clearingPrice'))
+        self.assertEqual(resources[0].fetch_fields, ('auctionUnit', 'clearingPrice', '_id'))
+        self.assertIsNone(load_resources(make_config(DEFAULTS))[0].fields)
+        self.assertIsNone(load_resources(make_config(DEFAULTS))[0].fetch_fields)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from unittest.mock import MagicMock
+import io
+import json
+import tempfile
+
+import requests
+
+from api.fetch_data import EsoApiClient
+from api.response_cache import ResponseCache
+
+URL = "https://api.nationalgrideso.com/api/3/action/datastore_search_sql"
+
+def make_response(status_code, body=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = URL
+    response.raw = io.BytesIO(body)
+    response.headers.update(headers or {})
+    return response
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = ResponseCache(self.directory.name, max_bytes=1024, ttl=60)
+        self.client = EsoApiClient(cache=self.cache)
+        self.client.session.post = MagicMock()
+
+    def body(self, page):
+        return json.dumps({"success": True, "result": {"records": [{"_id": page}]}}).encode('utf-8')
+
+    def test_entry_without_validators_is_served_within_ttl(self):
+        self.client.session.post.return_value = make_response(200, self.body(1))
+
+        first = self.client.post(URL, {"sql": "page 1"}).json()
+        second = self.client.post(URL, {"sql": "page 1"}).json()
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.client.session.post.call_count, 1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_expired_entry_is_fetched_again(self):
+        self.client.session.post.side_effect = [make_response(200, self.body(1)), make_response(200, self.body(2))]
+        self.client.post(URL, {"sql": "page 1"})
+        self.cache.ttl = 0
+
+        self.assertEqual(self.client.post(URL, {"sql": "page 1"}).json()['result']['records'], [{"_id": 2}])
+        self.assertEqual(self.cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_entry_with_etag_is_revalidated(self):
+        self.client.session.post.side_effect = [
+            make_response(200, self.body(1), {'ETag': '"v1"'}),
+            make_response(304),
+        ]
+        self.client.post(URL, {"sql": "page 1"})
+
+        response = self.client.post(URL, {"sql": "page 1"})
+
+        self.assertEqual(response.json()['result']['records'], [{"_id": 1}])
+        self.assertEqual(self.client.session.post.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_streamed_hit_reads_from_disk(self):
+        self.client.session.post.return_value = make_response(200, self.body(1))
+        self.client.post(URL, {"sql": "page 1"})
+
+        response = self.client.post(URL, {"sql": "page 1"}, stream=True)
+        body = b''.join(response.iter_content(chunk_size=8))
+        response.close()
+
+        self.assertEqual(body, self.body(1))
+        self.assertTrue(response.raw.closed)
+
+    def test_errors_are_not_cached(self):
+        self.client.session.post.return_value = make_response(404)
+
+        self.client.post(URL, {"sql": "page 1"})
+        self.client.post(URL, {"sql": "page 1"})
+
+        self.assertEqual(self.client.session.post.call_count, 2)
+
+    def test_least_recently_used_entries_are_evicted_by_size(self):
+        padding = b' ' * 400
+        self.client.session.post.side_effect = [make_response(200, self.body(page) + padding) for page in (1, 2, 3)]
+        self.client.post(URL, {"sql": "page 1"})
+        self.client.post(URL, {"sql": "page 2"})
+        self.client.post(URL, {"sql": "page 1"})  # page 2 is now the least recently used
+
+        self.client.post(URL, {"sql": "page 3"})
+
+        def is_cached(page):
+            return self.cache.lookup(self.cache.key(URL, json.dumps({"sql": f"page {page}"}))) is not None
+        self.assertEqual([is_cached(page) for page in (1, 2, 3)], [True, False, True])
+
+if __name__ == '__main__':
+    unittest.main()
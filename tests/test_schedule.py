@@ -0,0 +1,41 @@
+import unittest
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
+
+from utils.schedule import PollSchedule
+
+LONDON = ZoneInfo('Europe/London')
+
+class TestPollSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = PollSchedule(publish_times=[time(15, 0)], window_minutes=30, min_interval=60,
+                                     max_interval=900, backoff_factor=2)
+
+    def test_polls_tighten_around_the_publish_time(self):
+        for now in [datetime(2024, 8, 6, 14, 30, tzinfo=LONDON), datetime(2024, 8, 6, 15, 29, tzinfo=LONDON)]:
+            with self.subTest(now=now):
+                self.assertEqual(self.schedule.next_delay(False, now), 60)
+
+    def test_unchanged_polls_back_off_up_to_the_maximum(self):
+        now = datetime(2024, 8, 6, 3, 0, tzinfo=LONDON)
+
+        delays = [self.schedule.next_delay(False, now) for _ in range(6)]
+
+        self.assertEqual(delays, [120, 240, 480, 900, 900, 900])
+        self.assertEqual(self.schedule.next_delay(True, now), 60)
+
+    def test_sleep_ends_at_the_next_window(self):
+        now = datetime(2024, 8, 6, 14, 25, tzinfo=LONDON)
+        self.schedule.interval = 900
+
+        self.assertEqual(self.schedule.next_delay(False, now), 300)
+
+    def test_window_after_midnight(self):
+        schedule = PollSchedule(publish_times=[time(0, 10)], window_minutes=30)
+
+        self.assertTrue(schedule.in_window(datetime(2024, 8, 6, 23, 50, tzinfo=LONDON)))
+        self.assertFalse(schedule.in_window(datetime(2024, 8, 6, 23, 30, tzinfo=LONDON)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import threading
+import time
+import unittest
+
+from utils.single_flight import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_call(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return {'records': []}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('page', fetch)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do('page', fetch))) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result is results[0] for result in results))
+        # Nothing is cached once the call returned
+        flight.do('page', fetch)
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ConnectionError("HTTP 503")
+
+        with self.assertRaises(ConnectionError):
+            flight.do('page', fail)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+
+from db.writer import DatabaseWriter
+from utils.stages import BackgroundIterator
+
+class TestBackgroundIterator(unittest.TestCase):
+
+    def test_items_are_passed_through_in_order(self):
+        with BackgroundIterator(range(100), maxsize=3) as items:
+            self.assertEqual(list(items), list(range(100)))
+
+    def test_producer_errors_reach_the_consumer(self):
+        def produce():
+            yield 1
+            raise ConnectionError("HTTP 503")
+
+        items = BackgroundIterator(produce())
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(ConnectionError):
+            next(items)
+        items.close()
+
+    def test_producer_runs_ahead_by_the_queue_size(self):
+        produced = []
+
+        def produce():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        with BackgroundIterator(produce(), maxsize=2) as items:
+            next(items)
+            time.sleep(0.2)
+            # Two queued items and one waiting to be queued
+            self.assertLessEqual(len(produced), 4)
+
+    def test_closing_stops_the_producer(self):
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                while True:
+                    yield 1
+            finally:
+                stopped.set()
+
+        items = BackgroundIterator(produce(), maxsize=1)
+        next(items)
+        items.close()
+
+        self.assertTrue(stopped.is_set())
+        self.assertEqual(list(items), [])
+
+class TestDatabaseWriter(unittest.TestCase):
+
+    def test_jobs_run_in_order_on_one_thread(self):
+        writer = DatabaseWriter()
+        threads, order = set(), []
+
+        def job(i):
+            threads.add(threading.get_ident())
+            order.append(i)
+            return i
+
+        futures = [writer.submit(job, i) for i in range(10)]
+        writer.close()
+
+        self.assertEqual([future.result() for future in futures], list(range(10)))
+        self.assertEqual(order, list(range(10)))
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_errors_are_set_on_the_future(self):
+        writer = DatabaseWriter()
+
+        future = writer.submit(int, 'not a number')
+        writer.close()
+
+        self.assertIsInstance(future.exception(), ValueError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import random
+
+from utils.type_inference import value_kind, widen, reservoir_sample, infer_field_kinds
+
+class TestWidening(unittest.TestCase):
+
+    def test_bool_is_not_an_int(self):
+        self.assertEqual(value_kind(True), 'bool')
+        self.assertEqual(value_kind(1), 'int')
+
+    def test_numeric_kinds_widen(self):
+        self.assertEqual(widen('bool', 'int'), 'int')
+        self.assertEqual(widen('int', 'float'), 'float')
+        self.assertEqual(widen('float', 'bool'), 'float')
+
+    def test_incompatible_kinds_widen_to_string(self):
+        self.assertEqual(widen('datetime', 'string'), 'string')
+        self.assertEqual(widen('datetime', 'int'), 'string')
+        self.assertEqual(widen('string', 'float'), 'string')
+
+    def test_nulls_do_not_widen(self):
+        self.assertEqual(widen(None, 'int'), 'int')
+        self.assertEqual(widen('int', None), 'int')
+
+class TestInferFieldKinds(unittest.TestCase):
+
+    def test_later_values_widen_the_first(self):
+        records = [
+            {"_id": 1, "executedQuantity": 36, "flag": True, "deliveryEnd": "2024-08-06T22:00:00", "note": None},
+            {"_id": 2, "executedQuantity": 36.5, "flag": False, "deliveryEnd": "not published", "note": None},
+        ]
+
+        kinds = infer_field_kinds(records)
+
+        self.assertEqual(kinds, {"_id": 'int', "executedQuantity": 'float', "flag": 'bool',
+                                 "deliveryEnd": 'string', "note": None})
+
+    def test_stops_once_stable(self):
+        inspected = []
+
+        def records():
+            for i in range(10000):
+                inspected.append(i)
+                yield {"_id": i, "clearingPrice": 1.5}
+
+        infer_field_kinds(records(), sample_size=1000, stable_after=50)
+
+        self.assertEqual(len(inspected), 51)
+
+    def test_null_columns_keep_sampling(self):
+        records = [{"_id": i, "postCode": None} for i in range(300)] + [{"_id": 300, "postCode": "TN17"}]
+
+        self.assertEqual(infer_field_kinds(records, stable_after=10)["postCode"], 'string')
+        self.assertIsNone(infer_field_kinds(records, sample_size=300, stable_after=10)["postCode"])
+
+    def test_reservoir_sample_covers_the_stream(self):
+        sample = reservoir_sample(iter(range(10000)), 100, random.Random(1))
+
+        self.assertEqual(len(sample), 100)
+        self.assertGreater(max(sample), 5000)
+
+    def test_reservoir_inference_sees_late_values(self):
+        records = [{"price": 1} for _ in range(5000)] + [{"price": 1.5} for _ in range(5000)]
+
+        self.assertEqual(infer_field_kinds(records, sample_size=200, reservoir=True)["price"], 'float')
+        self.assertEqual(infer_field_kinds(records, sample_size=200)["price"], 'int')
+
+if __name__ == '__main__':
+    unittest.main()
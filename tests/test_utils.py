@@ -0,0 +1,39 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from utils.utils import is_datetime, parse_datetime
+
+class TestParseDatetime(unittest.TestCase):
+
+    def test_iso_8601_shapes(self):
+        cases = {
+            "2024-08-06": datetime(2024, 8, 6),
+            "2024-08-06T17:00": datetime(2024, 8, 6, 17, 0),
+            "2024-08-06T17:00:00": datetime(2024, 8, 6, 17, 0, 0),
+            "2024-08-06 17:00:00.5": datetime(2024, 8, 6, 17, 0, 0, 500000),
+            "2024-08-06T17:00:00.123456Z": datetime(2024, 8, 6, 17, 0, 0, 123456, timezone.utc),
+            "2024-08-06T17:00:00+01:00": datetime(2024, 8, 6, 17, tzinfo=timezone(timedelta(hours=1))),
+            "2024-08-06T17:00:00-0530": datetime(2024, 8, 6, 17, tzinfo=timezone(-timedelta(hours=5, minutes=30))),
+        }
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_datetime(value), expected)
+                self.assertEqual(parse_datetime(value), datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+    def test_rejects_non_iso_strings(self):
+        for value in ("March 10th 2024", "HAB6-FFR", "579#||#87#||#DCH#||#24070", "2024-13-01", "2024-08-06T25:00",
+                      "2024-08-06Tjunk"):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_datetime(value))
+                self.assertFalse(is_datetime(value))
+
+    def test_dateutil_fallback_is_opt_in(self):
+        self.assertFalse(is_datetime("March 10th 2024"))
+        self.assertTrue(is_datetime("March 10th 2024", fallback=True))
+        self.assertEqual(parse_datetime("March 10th 2024", fallback=True), datetime(2024, 3, 10))
+
+    def test_short_values_are_not_datetimes(self):
+        self.assertFalse(is_datetime("2024-08"))
+
+if __name__ == '__main__':
+    unittest.main()
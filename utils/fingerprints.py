@@ -0,0 +1,39 @@
+import json
+import os
+import tempfile
+import threading
+
+_lock = threading.Lock()
+
+def load_fingerprints(path):
+    """
+    Read the stored upstream fingerprints.
+
+    Parameters:
+    path (str): The JSON file holding the fingerprints.
+
+    Returns:
+    dict: Fingerprint per resource key, empty if the file is missing or unreadable.
+    """
+    try:
+        with open(path) as fingerprint_file:
+            return json.load(fingerprint_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_fingerprint(path, key, fingerprint):
+    """
+    Store the fingerprint of one resource, keeping the others.
+
+    Parameters:
+    path (str): The JSON file holding the fingerprints.
+    key (str): The resource key.
+    fingerprint (str): The fingerprint of the ingested upstream state.
+    """
+    with _lock:
+        fingerprints = load_fingerprints(path)
+        fingerprints[key] = fingerprint
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with os.fdopen(fd, 'w') as fingerprint_file:
+            json.dump(fingerprints, fingerprint_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+
+RESOURCE_SECTION_PREFIX = 'resource:'
+
+@dataclass(frozen=True)
+class Resource:
+    """
+    One datastore resource to ingest and the table and database it is stored in.
+    """
+    name: str
+    resource_id: str
+    table_name: str
+    database_url: str
+    participant_name: str
+    page_size: int
+    limit: int
+    fetch_concurrency: int
+    fields: tuple = None
+    upsert: bool = False
+    dedupe_key: tuple = ('_id',)
+    batch_size: int = 1000
+
+    @property
+    def fetch_fields(self):
+        """
+        Fields to fetch and store, always including the dedupe key columns; None for all.
+        """
+        return self.fields and tuple(dict.fromkeys((*self.fields, *self.dedupe_key)))
+
+    @property
+    def sync_key(self):
+        """
+        Key of the resource's high-watermark; sections sharing a resource_id or table keep their own.
+        """
+        return f"{self.resource_id}#{self.table_name}#{self.name}"
+
+def default_table_name(resource_id):
+    """
+    Name of the table a resource is stored in unless configured otherwise.
+    """
+    return f'auction_results_{resource_id[:8]}'
+
+def _split_list(value):
+    items = tuple(item.strip() for item in value.split(',') if item.strip())
+    return items or None
+
+def _load_resource(name, section, api, database):
+    resource_id = section.get('resource_id', fallback=api.get('resource_id'))
+    if not resource_id:
+        raise ValueError(f"Resource {name} has no resource_id")
+    dedupe_key = _split_list(section.get('dedupe_key', fallback=database.get('dedupe_key', fallback=''))) or ('_id',)
+    return Resource(
+        name=name,
+        resource_id=resource_id,
+        table_name=section.get('table', fallback=default_table_name(resource_id)),
+        database_url=section.get('database', fallback=database['url']),
+        participant_name=section.get('participant_name', fallback=api.get('participant_name')),
+        page_size=section.getint('page_size', fallback=api.getint('page_size', fallback=0)),
+        limit=section.getint('limit', fallback=api.getint('limit')),
+        fetch_concurrency=section.getint('fetch_concurrency', fallback=api.getint('fetch_concurrency', fallback=1)),
+        fields=_split_list(section.get('fields', fallback=api.get('fields', fallback=''))),
+        upsert=section.getboolean('upsert', fallback=database.getboolean('upsert', fallback=False)),
+        dedupe_key=dedupe_key,
+        batch_size=section.getint('batch_size', fallback=database.getint('batch_size', fallback=1000)),
+    )
+
+def load_resources(config):
+    """
+    Read the resources to ingest from the configuration.
+
+    Every [resource:<name>] section is one resource; keys it does not set are
+    taken from [api] and [database]. Without any such section the single
+    resource described by [api] and [database] is used.
+
+    Parameters:
+    config (configparser.ConfigParser): The loaded config.ini.
+
+    Returns:
+    list: Resource for each configured resource.
+    """
+    api = config['api']
+    database = config['database']
+    sections = [section for section in config.sections() if section.startswith(RESOURCE_SECTION_PREFIX)]
+    if not sections:
+        return [_load_resource('default', api, api, database)]
+    return [
+        _load_resource(section[len(RESOURCE_SECTION_PREFIX):], config[section], api, database)
+        for section in sections
+    ]
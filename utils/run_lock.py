@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# How often a waiting acquire retries the lock (seconds)
+POLL_INTERVAL = 1.0
+
+class RunLock:
+    """
+    Advisory lock on a file, held by one process at a time.
+
+    The lock is released by the operating system when its holder exits, so a
+    crashed run never leaves it stuck. The holder records the outcome of its
+    run in the file on release, which lets a run that waited for it decide
+    whether the work was already done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def _try_lock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, wait=False, timeout=None):
+        """
+        Take the lock.
+
+        Parameters:
+        wait (bool): Wait for the current holder to release it.
+        timeout (float): Seconds to wait at most, None for no limit.
+
+        Returns:
+        bool: Whether the lock was taken.
+        """
+        # Opened without truncating, so the previous outcome stays readable
+        self._file = open(self.path, 'a+')
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._try_lock():
+            if not wait or (deadline is not None and time.monotonic() >= deadline):
+                self._file.close()
+                self._file = None
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def outcome(self):
+        """
+        The outcome recorded by the last holder.
+
+        Returns:
+        dict: 'pid', 'finished_at' (epoch seconds) and 'succeeded', or None if no run recorded one.
+        """
+        try:
+            with open(self.path) as lock_file:
+                return json.load(lock_file)
+        except (OSError, ValueError):
+            return None
+
+    def release(self, succeeded=None):
+        """
+        Record the outcome of the run, if given, and release the lock.
+
+        Parameters:
+        succeeded (bool): Whether the run succeeded, None to keep the recorded outcome.
+        """
+        if self._file is None:
+            return
+        if succeeded is not None:
+            self._file.seek(0)
+            self._file.truncate()
+            json.dump({'pid': os.getpid(), 'finished_at': time.time(), 'succeeded': succeeded}, self._file)
+            self._file.flush()
+        # Closing the file releases the lock
+        self._file.close()
+        self._file = None
@@ -0,0 +1,88 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+class PollSchedule:
+    """
+    Adaptive poll interval of the ingest daemon, aligned with the publication of auction results.
+
+    Within window_minutes of an expected publish time the daemon polls every
+    min_interval seconds. Outside of it, every poll that finds nothing new
+    multiplies the interval by backoff_factor, up to max_interval, and a poll
+    that finds new data resets it. Sleeps never run past the start of the
+    next publish window.
+    """
+
+    def __init__(self, publish_times=(time(15, 0),), window_minutes=60, min_interval=60, max_interval=1800,
+                 backoff_factor=2.0, timezone='Europe/London'):
+        """
+        Parameters:
+        publish_times (iterable): Times of day (datetime.time) results are expected upstream.
+        window_minutes (int): Minutes before and after a publish time polled at min_interval.
+        min_interval (float): Shortest interval between polls, in seconds.
+        max_interval (float): Longest interval between polls, in seconds.
+        backoff_factor (float): Growth of the interval after a poll that found nothing new.
+        timezone (str): Time zone of the publish times.
+        """
+        self.publish_times = sorted(publish_times)
+        self.window = timedelta(minutes=window_minutes)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.timezone = ZoneInfo(timezone)
+        self.interval = min_interval
+
+    @classmethod
+    def from_config(cls, section):
+        """
+        Build a schedule from a config.ini section, using the defaults for missing keys.
+
+        Parameters:
+        section (configparser.SectionProxy): The section holding the schedule settings.
+
+        Returns:
+        PollSchedule: The configured schedule.
+        """
+        publish_times = section.get('publish_times', fallback='15:00')
+        return cls(
+            publish_times=[time.fromisoformat(value.strip()) for value in publish_times.split(',') if value.strip()],
+            window_minutes=section.getint('window_minutes', fallback=60),
+            min_interval=section.getfloat('min_interval', fallback=60),
+            max_interval=section.getfloat('max_interval', fallback=1800),
+            backoff_factor=section.getfloat('backoff_factor', fallback=2.0),
+            timezone=section.get('timezone', fallback='Europe/London'),
+        )
+
+    def _windows(self, now):
+        # (start, end) of the publish windows of yesterday, today and tomorrow
+        for days in (-1, 0, 1):
+            day = now.date() + timedelta(days=days)
+            for publish_time in self.publish_times:
+                publish = datetime.combine(day, publish_time, self.timezone)
+                yield publish - self.window, publish + self.window
+
+    def in_window(self, now):
+        """
+        Whether now (an aware datetime) is within a publish window.
+        """
+        return any(start <= now <= end for start, end in self._windows(now))
+
+    def next_delay(self, changed, now=None):
+        """
+        Seconds to sleep before the next poll.
+
+        Parameters:
+        changed (bool): Whether the last poll found new data upstream.
+        now (datetime.datetime): The current time, aware; defaults to the clock.
+
+        Returns:
+        float: The delay until the next poll.
+        """
+        now = now or datetime.now(self.timezone)
+        if changed or self.in_window(now):
+            self.interval = self.min_interval
+            return self.interval
+        self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+        next_window = min((start for start, _ in self._windows(now) if start > now), default=None)
+        if next_window is None:
+            return self.interval
+        return min(self.interval, (next_window - now).total_seconds())
@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+    """
+    Share one call among the threads asking for the same key at the same time.
+
+    The first caller of a key runs the function; callers arriving while it
+    runs wait for it and get the same result (or exception). Once it returned,
+    the next call of the key runs the function again, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs), or wait for the call of the same key in flight.
+
+        Parameters:
+        key (hashable): Identifies calls with the same result.
+        function (callable): The call to run.
+
+        Returns:
+        The result of the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
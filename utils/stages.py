@@ -0,0 +1,86 @@
+import queue
+import threading
+
+# How often blocked queue operations check whether the stage was cancelled (seconds)
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+class BackgroundIterator:
+    """
+    Iterate an iterable on a background thread, handing items over through a bounded queue.
+
+    The producer thread runs at most maxsize items ahead of the consumer, so
+    the queue size is the stage's back-pressure. An exception raised by the
+    iterable is re-raised to the consumer once the items before it were
+    consumed. Closing the iterator (or leaving its with block) cancels the
+    producer and waits for its thread to exit.
+    """
+
+    def __init__(self, iterable, maxsize=2, name=None):
+        self._iterable = iterable
+        self._items = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, entry):
+        while not self._stop.is_set():
+            try:
+                self._items.put(entry, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for item in self._iterable:
+                if not self._put((item, None)):
+                    return
+        except BaseException as e:
+            self._put((_DONE, e))
+        else:
+            self._put((_DONE, None))
+        finally:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._stop.is_set():
+            try:
+                item, error = self._items.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self._thread.is_alive():
+                    continue
+                # Finished, or cancelled before it could report
+                raise StopIteration
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                raise StopIteration
+            return item
+        raise StopIteration
+
+    def cancel(self):
+        """
+        Ask the producer thread to stop after its current item.
+        """
+        self._stop.set()
+
+    def close(self):
+        """
+        Cancel the producer thread and wait for it to exit.
+        """
+        self.cancel()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
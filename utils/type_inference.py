@@ -0,0 +1,103 @@
+import random
+
+from utils.utils import is_datetime
+
+# Numeric kinds in widening order; any other mix of kinds widens to 'string'
+_NUMERIC_KINDS = ('bool', 'int', 'float')
+
+def value_kind(value):
+    """
+    Classify a JSON value for type inference.
+
+    Parameters:
+    value: A decoded JSON value.
+
+    Returns:
+    str: 'bool', 'int', 'float', 'datetime' or 'string', or None for a null.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):  # before int: bool is a subclass of int
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str) and is_datetime(value):
+        return 'datetime'
+    return 'string'
+
+def widen(current, kind):
+    """
+    The narrowest kind that holds values of both kinds.
+
+    bool widens to int, int to float, and everything else (e.g. datetime
+    mixed with text or numbers) to string. Nulls never widen a kind.
+    """
+    if current is None or current == kind:
+        return kind
+    if kind is None:
+        return current
+    if current in _NUMERIC_KINDS and kind in _NUMERIC_KINDS:
+        return max(current, kind, key=_NUMERIC_KINDS.index)
+    return 'string'
+
+def reservoir_sample(records, size, rng=None):
+    """
+    Uniformly sample up to size records from a stream of unknown length (algorithm R).
+
+    Parameters:
+    records (iterable): The records to sample.
+    size (int): Number of records to keep.
+    rng (random.Random): Source of randomness, for reproducible samples.
+
+    Returns:
+    list: The sampled records.
+    """
+    rng = rng or random.Random()
+    sample = []
+    for seen, record in enumerate(records):
+        if seen < size:
+            sample.append(record)
+        else:
+            slot = rng.randint(0, seen)
+            if slot < size:
+                sample[slot] = record
+    return sample
+
+def infer_field_kinds(records, sample_size=1000, stable_after=100, reservoir=False):
+    """
+    Infer the kind of every field from a sample of the records.
+
+    Kinds are widened as values are seen. With a head sample, inference stops
+    early once every field has a non-null kind and no kind has changed for
+    stable_after consecutive records.
+
+    Parameters:
+    records (iterable): The records to inspect.
+    sample_size (int): Maximum number of records inspected.
+    stable_after (int): Consecutive unchanged records after which inference stops.
+    reservoir (bool): Reservoir-sample the whole stream instead of reading its head.
+
+    Returns:
+    dict: Field names and their kinds (None for fields that were always null).
+    """
+    if reservoir:
+        records = reservoir_sample(records, sample_size)
+
+    kinds = {}
+    unchanged = 0
+    for inspected, record in enumerate(records):
+        if inspected >= sample_size:
+            break
+        changed = False
+        for key, value in record.items():
+            current = kinds.get(key)
+            kind = widen(current, value_kind(value))
+            if kind != current or key not in kinds:
+                kinds[key] = kind
+                changed = True
+        unchanged = 0 if changed else unchanged + 1
+        if unchanged >= stable_after and None not in kinds.values():
+            break
+    return kinds
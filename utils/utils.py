@@ -1,20 +1,111 @@
-from dateutil.parser import parse
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import chain, islice
 
-def is_datetime(value):
+# YYYY-MM-DD, optionally followed by [T ]HH:MM[:SS[.ffffff]] and Z or a UTC offset
+_ISO_8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?'
+    r'(Z|[+-]\d{2}(?::?\d{2})?)?)?$'
+)
+
+def _parse_offset(offset):
+    if offset == 'Z':
+        return timezone.utc
+    sign = -1 if offset[0] == '-' else 1
+    digits = offset[1:].replace(':', '')
+    minutes = int(digits[:2]) * 60 + int(digits[2:] or 0)
+    return timezone(sign * timedelta(minutes=minutes))
+
+def _parse_iso_8601(value):
+    match = _ISO_8601.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    try:
+        return datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int(fraction.ljust(6, '0')) if fraction else 0,
+            _parse_offset(offset) if offset else None,
+        )
+    except ValueError:  # shaped like a date but out of range, e.g. month 13
+        return None
+
+def _parse_free_text(value):
+    # dateutil accepts almost anything ("March 10th"), so it is only used on request
+    from dateutil.parser import parse
+    try:
+        return parse(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+@lru_cache(maxsize=4096)
+def parse_datetime(value, fallback=False):
+    """
+    Parse an ISO 8601 datetime string.
+
+    Results are memoised, since the same deliveryStart/deliveryEnd values
+    repeat across many records.
+
+    Parameters:
+    value (str): The value to parse.
+    fallback (bool): Try dateutil's free-text parser when the value is not ISO 8601.
+
+    Returns:
+    datetime.datetime: The parsed datetime, or None if the value is not a datetime string.
+    """
+    parsed = _parse_iso_8601(value)
+    if parsed is None and fallback:
+        parsed = _parse_free_text(value)
+    return parsed
+
+def is_datetime(value, fallback=False):
     """
     Check if a given value is a datetime string.
 
     Parameters:
     value (str): The value to check.
+    fallback (bool): Also accept strings only dateutil's free-text parser understands.
 
     Returns:
     bool: True if the value is a datetime string, False otherwise.
     """
     if len(value) < 10:  # ISO 8601 format is at least 10 characters long (YYYY-MM-DD)
         return False
-    
-    try:
-        parse(value)
-        return True
-    except (ValueError, TypeError):
-        return False
\ No newline at end of file
+
+    return parse_datetime(value, fallback) is not None
+
+def batched(iterable, size):
+    """
+    Group an iterable into lists of up to size items, lazily.
+
+    Parameters:
+    iterable (iterable): The items to group.
+    size (int): Maximum number of items per batch.
+
+    Yields:
+    list: The next batch of items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def peek(iterable, size):
+    """
+    Read up to size items from the head of an iterable without losing them.
+
+    Parameters:
+    iterable (iterable): The items to read.
+    size (int): Maximum number of items to buffer.
+
+    Returns:
+    tuple: The buffered head (list) and an iterator over all items, head included.
+    """
+    iterator = iter(iterable)
+    head = list(islice(iterator, size))
+    return head, chain(head, iterator)